@@ -1,15 +1,16 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
-from streamlit_folium import folium_static
-from streamlit_gsheets import GSheetsConnection
+import streamlit.components.v1 as components
 from streamlit_option_menu import option_menu
 
-from plots import reviews_wordcloud, average_rating_overtime, \
-    rating_breakdown_pie, sentiment_score_overtime, pharmacies_choropleth, top_performing_places, \
-    average_rating_wrt_month_year
-from template.html import card_view, review_card
-from utils import pre_process_data, create_map, get_star_ratings
-# from sqlalchemy import create_engine
+from data_loader import load_data, load_listing_index
+from filters import filter_listings
+from images import thumbnail, thumbnail_css
+from maps import map_cache_key, map_html, prewarm_maps
+from template.html import card_view, review_rows
+from tokens import token_frequencies
+from utils import RATING_LABELS, get_pharmacy_reviews, get_rating_rows
 
 # ------------------------------ Page Configuration------------------------------
 st.set_page_config(page_title="Pharmacies Listings", page_icon="📊", layout="wide")
@@ -18,6 +19,8 @@ st.set_page_config(page_title="Pharmacies Listings", page_icon="📊", layout="w
 
 with open("css/style.css") as css:
     st.markdown(f'<style>{css.read()}</style>', unsafe_allow_html=True)
+# card images, sent once per page and referenced by class from the cards
+st.markdown(thumbnail_css(), unsafe_allow_html=True)
 
 st.markdown("""
 <style>
@@ -45,29 +48,14 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # ----------------------------------- Data Loading ------------------------------
-conn = st.connection("gsheets", type=GSheetsConnection)
+data, reviews_data, review_index, rating_index, kpis, token_counts, token_index, data_version = load_data()
+listing_index, listing_ranking = load_listing_index(data_version, data)
+prewarm_maps(data_version, data, listing_index)
 
-data = conn.read(worksheet="Pharmacies")
-reviews_data = conn.read(worksheet="AllReviews")
-
-# data = pd.read_json("./data/Pharmacies.json")
-# data = data.transpose()
-# reviews_data = pd.read_json("./data/AllReviews.json")
-# reviews_data = reviews_data.transpose()
-
-data, reviews_data = pre_process_data(data, reviews_data)
-
-# name = st.secrets['credentials']['database']
-# end_point = st.secrets['credentials']['end_point']
-# username = st.secrets['credentials']['username']
-# password = st.secrets['credentials']['password']
-# port = st.secrets['credentials']['port']
-# db_url = f'postgresql://{username}:{password}@{end_point}:{port}/{name}'
-# engine = create_engine(db_url).connect()
-# Load data from the database into DataFrames
-# pharmacies_df = pd.read_sql_table('Pharmacies', con=engine)
-# reviews_df = pd.read_sql_table('Reviews', con=engine)
-# data, reviews_data = pre_process_data(pharmacies_df, reviews_df)
+# Page sizes offered in the List View, the first one is the default.
+LIST_PAGE_SIZES = [10, 25, 50, 100]
+# Page sizes offered for the reviews of a pharmacy.
+REVIEW_PAGE_SIZES = [50, 100, 500, 1000]
 
 
 # ----------------------------------- Main App ----------------------------------
@@ -80,8 +68,8 @@ def main():
 
     # ----- Tab for Map View -----
     if menu == "Pharmacies Map":
-        pharmacies_map = map_view()
-        st_data = folium_static(pharmacies_map, width=1500, height=650)
+        # same frame as folium_static, which adds 10 pixels to the height of the map
+        components.html(map_view(), width=1500, height=650 + 10)
 
     # ----- Tab for List View -----
     elif menu == "List View":
@@ -101,22 +89,16 @@ def map_view():
     Function to customize view of the map tab
     - Have filters for choosing preferred location.
     - Map with custom markers, popup and frames for displaying results.
-    :return: Map view
+    :return: HTML page of the map, rendered once per selection of filters
     """
-    filtered_data = data.copy()
-
     map_filters = st.columns((1, 2, 1))
-    name = map_filters[0].multiselect(label="Search by Name", options=data["name"].unique(), placeholder="All")
-    if name:
-        filtered_data = filtered_data[(filtered_data["name"].isin(name))]
-    address = map_filters[1].multiselect(label="Address", options=data["address"].unique(), placeholder="All")
-    if address:
-        filtered_data = filtered_data[(filtered_data["address"].isin(address))]
-    city = map_filters[2].multiselect(label="City", options=data["city"].unique(), placeholder="All")
-    if city:
-        filtered_data = filtered_data[(filtered_data["city"].isin(city))]
-
-    pharmacies_map = create_map(filtered_data)
+    # options are the distinct values held by the listing index, no pass over the listings
+    name = map_filters[0].multiselect(label="Search by Name", options=list(listing_index["name"][0]), placeholder="All")
+    address = map_filters[1].multiselect(label="Address", options=list(listing_index["address"][0]), placeholder="All")
+    city = map_filters[2].multiselect(label="City", options=list(listing_index["city"][0]), placeholder="All")
+
+    rows = filter_listings(listing_index, {"name": name, "address": address, "city": city})
+    pharmacies_map = map_html(map_cache_key(data_version, name, address, city), data, rows)
 
     return pharmacies_map
 
@@ -130,62 +112,47 @@ def list_view():
     - Data view in list with pharmacy detail on left and its reviews on right.
     """
     filters = st.columns((1, 2, 2, 2))
-    names = list(data["name"].unique())
-    names.insert(0, "All")
-    stars = filters[0].multiselect(label="Rating", options=[5, 4, 3, 2, 1], placeholder="All")
+    names = ["All", *listing_index["name"][0]]
+    stars = filters[0].multiselect(label="Rating", options=list(RATING_LABELS), placeholder="All")
     reviews = filters[1].multiselect(label="Min. Reviewers",
                                      options=["Up-to 50", "50 to 100", "100-200", "More than 200"],
                                      placeholder="All")
     name = filters[2].selectbox(label="Search by Name", options=names)
-    city = filters[3].multiselect(label="City", options=data["city"].unique(), placeholder="All")
+    city = filters[3].multiselect(label="City", options=list(listing_index["city"][0]), placeholder="All")
 
-    if not stars:  # if user chooses 'All'
-        stars = [5, 4, 3, 2, 1]
-    if not reviews:  # if user selected 'All'
-        reviews = data["adjustedReview"].unique()
-    if not city:  # If selected option is 'All'
-        city = data["city"].unique()
+    if not stars:  # if user chooses 'All', pharmacies without rating stay hidden
+        stars = list(RATING_LABELS)
 
-    df = filter_data(stars, reviews, name, city)
-    display_list_view(df)
+    # other filters left empty ('All') select every pharmacy, rows come in List View order (see filters.rank_listings)
+    rows = filter_listings(listing_index, {"adjustedRating": stars, "adjustedReview": reviews, "city": city,
+                                           "name": None if name == "All" else [name]},
+                           order=listing_ranking)
+    display_list_view(rows)
 
 
-def filter_data(stars: list, reviews: list, name: str, city: list) -> pd.DataFrame:
-    """
-    Filter data based on provided parameters.
-    :param stars: list of values that filtered data should have in ratings columns
-    :param reviews: list of values that filtered data should have in review columns
-    :param name: name of the pharmacy
-    :param city: list of values that filtered data should have in city columns
-    :return: filtered dataframe with values that are in provided lists.
+def display_list_view(rows: np.ndarray):
     """
-    df = data.copy()
-    df = df[df["adjustedRating"].isin(stars)]
-    df = df[df["adjustedReview"].isin(reviews)]
-    df = df[df["city"].isin(city)]
-    if name != "All":
-        df = df[df["name"] == name]
-    df.dropna(axis=0, inplace=True)
-    return df
-
-
-def display_list_view(df: pd.DataFrame):
-    """
-    function to iterate over data after sorted to display it on individual rows
-    :param df: dataframe of pharmacies data
+    function to iterate over data after sorted to display it on individual rows,
+    one page of pharmacies at a time.
+    :param rows: positions of the pharmacies to list in data, in their ranking order
     :return: None
     """
     st.write("# ")
-    # sorting listings by 'rank' column
-    pharmacies = df.sort_values(['totalReviews', 'averageRating'], ascending=[False, False])
-    pharmacies.reset_index(drop=True, inplace=True)
-    # pharmacies = df.sort_values(by="rank", ascending=True)
 
-    if len(pharmacies) == 0:
+    if len(rows) == 0:
         # if there is no pharmacy after filtering
         st.info("No Listed Pharmacy found!", icon="🚨")
     else:
-        for i, pharmacy in pharmacies.iterrows():
+        pager = st.columns((6, 1, 1))
+        page_size = pager[2].selectbox(label="Per Page", options=LIST_PAGE_SIZES)
+        total_pages = -(-len(rows) // page_size)
+        # options change with the filters, which resets the selection to the first page
+        page = pager[1].selectbox(label="Page", options=range(1, total_pages + 1))
+        pager[0].write(f"{len(rows)} pharmacies, page {page} of {total_pages}")
+
+        # only the listings of the current page are taken from data
+        start = (page - 1) * page_size
+        for i, (_, pharmacy) in enumerate(data.iloc[rows[start:start + page_size]].iterrows(), start=start):
             display_pharmacy(i, pharmacy)
 
 
@@ -198,94 +165,90 @@ def display_pharmacy(i: int, pharmacy: pd.Series):
     """
     upper_row = st.columns(2)
     # filtering pharmacy data based on current pharmacy
-    pharmacy_reviews = reviews_data[reviews_data.place_Name == pharmacy["name"]]
+    pharmacy_reviews = get_pharmacy_reviews(reviews_data, review_index, pharmacy["name"])
     with upper_row[0]:
         row = st.columns((1, 2, 8))
         # card view
         row[0].write(f"# ")
         row[0].write(f"### {i + 1}")
         # image on left
-        row[1].image(r"./assets/icon-min.png")
+        row[1].markdown(thumbnail("pharmacy"), unsafe_allow_html=True)
         # info on right
         row[2].markdown(card_view(pharmacy["name"], pharmacy["address"],
                                   f"{pharmacy['averageRating']:.1f}", pharmacy["totalReviews"],
                                   pharmacy["contact"]),
                         unsafe_allow_html=True)
     with upper_row[1]:
-        # Pharmacy Reviews Tab
-        review_bar = st.expander(label=f"Reviews ({len(pharmacy_reviews)})")
-        with review_bar:
-            # filter to choose results based on star rating
-            review_star = st.multiselect(label=" ",
-                                         options=["⭐ 5 😊", "⭐ 4 🙂", "⭐ 3 😕", "⭐ 2 😒", "⭐ 1 😑"],
-                                         placeholder="All ⭐",
-                                         key=f"{pharmacy['id']}-star")
-            # reviews display
-            display_reviews(review_star, pharmacy_reviews)
+        # Pharmacy Reviews Tab, reviews are only rendered once the user asks for them
+        show_reviews = st.toggle(label=f"Reviews ({len(pharmacy_reviews)})", key=f"{pharmacy['id']}-reviews")
+        if show_reviews:
+            with st.expander(label="Reviews", expanded=True):
+                # filter to choose results based on star rating
+                review_star = st.multiselect(label=" ",
+                                             options=list(RATING_LABELS),
+                                             format_func=RATING_LABELS.get,
+                                             placeholder="All ⭐",
+                                             key=f"{pharmacy['id']}-star")
+                # reviews display
+                display_reviews(review_star, pharmacy_reviews, pharmacy["name"], key=str(pharmacy['id']))
     st.write("---")
 
 
-def display_reviews(review_star: list, pharmacy_reviews: pd.DataFrame):
+def display_reviews(review_star: list, pharmacy_reviews: pd.DataFrame, place: str, key: str):
     """
-    Function to display reviews in customized html cards on individual rows.
-    :param review_star: list containing filtered rating.
+    Function to display reviews in customized html cards on individual rows, one page of reviews at a time.
+    :param review_star: list containing filtered rating, keys of RATING_LABELS.
     :param pharmacy_reviews: dataframe containing pharmacies reviews.
+    :param place: name of the pharmacy, to look up its reviews per rating.
+    :param key: prefix of the keys of the pagination widgets.
     :return:
     """
     if len(review_star) == 0:  # if user selects 'All'
-        star_rating_list = [5, 4, 3, 2, 1]
+        rows = np.arange(len(pharmacy_reviews))
     else:
-        star_rating_list = get_star_ratings(review_star)  # get mapped equivalent list
-
-    # filtering data based on user selected ratings
-    filtered_reviews_df = pharmacy_reviews[pharmacy_reviews["rating"].isin(star_rating_list)]
+        # filtering data based on user selected ratings
+        rows = get_rating_rows(rating_index, place, review_star)
 
     # if no reviews found for current rating selection
-    if len(filtered_reviews_df) == 0:
+    if len(rows) == 0:
         st.info("No reviews found!", icon="🚨")
     else:
-        filtered_reviews_df = filtered_reviews_df.sort_values(by="datetime", ascending=False)
-        # displaying reviews info one by one
-        for _, review in filtered_reviews_df.iterrows():
-            row_ = st.columns((1, 6))
-            # reviewer image on left
-            row_[0].image(r"./assets/reviewer.png")
-            # review detail on right
-            row_[1].markdown(review_card(review['reviewer'], review['date'],
-                                         review['rating']),
-                             unsafe_allow_html=True)
-            # review text on bottom
-            if review["text"] != "nan":
-                st.write(f"{review['text']}")
-            st.write("---")
-
-
-def calculate_kpis(filtered_data: pd.DataFrame):
+        # rows are in 'datetime' order, latest reviews first
+        rows = rows[::-1]
+        pager = st.columns((4, 1, 1))
+        page_size = pager[2].selectbox(label="Per Page", options=REVIEW_PAGE_SIZES, key=f"{key}-page-size")
+        total_pages = -(-len(rows) // page_size)
+        page = pager[1].selectbox(label="Page", options=range(1, total_pages + 1), key=f"{key}-page")
+        pager[0].write(f"{len(rows)} reviews, page {page} of {total_pages}")
+
+        # the whole page of review cards is sent as a single HTML block
+        reviews = pharmacy_reviews.iloc[rows[(page - 1) * page_size:page * page_size]]
+        st.markdown(review_rows(zip(reviews["reviewer"], reviews["datetime"].dt.strftime("%d-%m-%Y"),
+                                    reviews["rating"], reviews["text"])),
+                    unsafe_allow_html=True)
+
+
+def calculate_kpis(place: str):
     """
-    Function to calculate KPI values
-    :param filtered_data: filtered data based on user preferences
+    Function to look up the KPI values materialized at load time (see utils.pharmacy_kpis)
+    :param place: name of the selected pharmacy
     :return: Tuple(int, float, float, float)
     """
-    # total reviews of a pharmacy
-    total_reviews = len(filtered_data)
-    # average rating for a pharmacy
-    average_ratings = filtered_data['rating'].mean()
-    # total number of unique years
-    total_years = filtered_data['datetime'].dt.year.nunique()
-    # yearly review rate/frequency
-    yearly_reviews_rate_percentage = (total_reviews / total_years)
-    # rating ratio
-    rating_ratio = (average_ratings * total_reviews / len(reviews_data)) * 100
+    # total reviews, average rating, yearly review rate/frequency and rating ratio of the pharmacy
+    total_reviews, average_ratings, yearly_reviews_rate_percentage, rating_ratio = kpis.loc[place]
+    return int(total_reviews), average_ratings, yearly_reviews_rate_percentage, rating_ratio
 
-    return total_reviews, average_ratings, yearly_reviews_rate_percentage, rating_ratio
 
-
-def display_reviews_analysis(filtered_data: pd.DataFrame) -> None:
+def display_reviews_analysis(filtered_data: pd.DataFrame, place: str) -> None:
     """
     Function to display reviews analytics.
     :param filtered_data: filtered data based on user preferences.
+    :param place: name of the selected pharmacy.
     :return: None
     """
+    # the plotting stack is only imported once an analytics tab is opened
+    from plots import reviews_wordcloud_png, average_rating_overtime, rating_breakdown_pie, \
+        sentiment_score_overtime, average_rating_wrt_month_year
 
     charts_row = st.columns((4, 3))
     # Chart to display Reviews Distribution w.r.t Quarter-Year
@@ -295,8 +258,12 @@ def display_reviews_analysis(filtered_data: pd.DataFrame) -> None:
 
     # scatter plot to display sentiment score over the time
     charts_row[0].plotly_chart(sentiment_score_overtime(filtered_data), use_container_width=True)
-    # Wordcloud figure to analyze frequently occurring words in review text
-    charts_row[1].pyplot(reviews_wordcloud(filtered_data), use_container_width=True)
+    # Wordcloud figure to analyze frequently occurring words in review text, cached per pharmacy
+    wordcloud = reviews_wordcloud_png(token_frequencies(token_counts, token_index, place), place)
+    if wordcloud is None:
+        charts_row[1].info("The reviews have no words to draw a wordcloud from.", icon="🚨")
+    else:
+        charts_row[1].image(wordcloud, use_column_width=True)
 
     # chart to display the varying rating over the time
     st.plotly_chart(average_rating_wrt_month_year(filtered_data), use_container_width=True)
@@ -315,11 +282,12 @@ def review_analytics_page():
     :return: Streamlit frame/view
     """
     filter_kpi_row = st.columns((4, 1, 2, 2, 2, 2))
-    place = filter_kpi_row[0].selectbox("Select Pharmacy", options=reviews_data["place_Name"].unique())
+    place = filter_kpi_row[0].selectbox("Select Pharmacy", options=list(review_index))
 
-    filtered_data = reviews_data[(reviews_data['place_Name'] == place)]
+    # the charts add columns, the shared reviews are left untouched
+    filtered_data = get_pharmacy_reviews(reviews_data, review_index, place).copy()
 
-    total_reviews, average_ratings, yearly_reviews_rate_percentage, rating_ratio = calculate_kpis(filtered_data)
+    total_reviews, average_ratings, yearly_reviews_rate_percentage, rating_ratio = calculate_kpis(place)
     # Average rating for the selected pharmacy
     filter_kpi_row[2].metric(label="Average Rating", value=f"{average_ratings:.1f}")
     # Total reviews of the selected pharmacy
@@ -330,7 +298,7 @@ def review_analytics_page():
     filter_kpi_row[5].metric(label="Yearly Reviews Rate", value=f"{yearly_reviews_rate_percentage:.2f} %")
 
     # calling function to display analytics charts based on selected place
-    display_reviews_analysis(filtered_data)
+    display_reviews_analysis(filtered_data, place)
 
 
 @st.cache_resource
@@ -339,6 +307,8 @@ def market_analysis_page():
     Function to create view for the 'Market Analysis' tab
     :return: Analytics charts
     """
+    from plots import pharmacies_choropleth, top_performing_places
+
     cols = st.columns(2)
     cols[0].write("#### Geographical Distribution of Ratings")
     cols[0].plotly_chart(pharmacies_choropleth(data), use_container_width=True)
@@ -0,0 +1,225 @@
+"""
+Offline jobs for the Pharmacies Listings app.
+Run `python cli.py --help` to list the available commands.
+"""
+import argparse
+import os
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+
+import pandas as pd
+
+from data_loader import read_worksheet, write_snapshot_chunks, append_snapshot, read_watermark, select_new_reviews, \
+    snapshot_age, read_review_stats, read_review_chunks, split_reviews, pre_process_review_chunks, \
+    memory_report, read_token_counts, snapshot_lock, SNAPSHOT_DIR, REVIEWS_CHUNK_SIZE, LISTINGS_DTYPES, REVIEWS_DTYPES
+from images import build_thumbnails, THUMBNAILS, THUMBNAIL_DIR
+from nlp_resources import provision_nltk_resources, NLTK_RESOURCES, NLTK_DATA_DIR
+from plots import reviews_wordcloud_png, WORDCLOUD_CACHE_PATH
+from tokens import token_frequencies
+from utils import pre_process_data, pre_process_listings_data, pre_process_reviews, review_digest, \
+    score_reviews_parallel, warm_sentiment_worker, index_rows, \
+    SENTIMENT_SCORES_PATH, SENTIMENT_CHUNK_SIZE
+
+
+# Modules app.py imports before the first page is rendered.
+STARTUP_MODULES = ["streamlit", "streamlit_option_menu", "data_loader", "filters", "images", "maps", "template.html",
+                   "tokens", "utils"]
+
+
+def read_source(source: str, worksheet: str) -> pd.DataFrame:
+    """
+    Reads a raw table from the Google Sheet or from a directory of JSON exports.
+    :param source: 'gsheets' or a directory containing e.g. Pharmacies.json and AllReviews.json
+    :param worksheet: name of the worksheet, e.g. 'Pharmacies' or 'AllReviews'.
+    :return: DataFrame with the raw table.
+    """
+    if source == "gsheets":
+        return read_worksheet(worksheet)
+    return pd.read_json(os.path.join(source, f"{worksheet}.json")).transpose()
+
+
+def read_source_chunks(source: str, worksheet: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """
+    Reads a raw table in chunks. A CSV, JSON lines or parquet export in the source directory
+    is streamed from disk, otherwise the table is read whole and split.
+    :param source: 'gsheets' or a directory containing e.g. AllReviews.csv or AllReviews.json
+    :param worksheet: name of the worksheet, e.g. 'AllReviews'.
+    :param chunk_size: maximum number of rows per chunk.
+    :return: iterator over the raw chunks.
+    """
+    for extension in (".csv", ".jsonl", ".parquet"):
+        file = os.path.join(source, f"{worksheet}{extension}")
+        if source != "gsheets" and os.path.exists(file):
+            return read_review_chunks(file, chunk_size)
+    return split_reviews(read_source(source, worksheet), chunk_size)
+
+
+def score(args: argparse.Namespace) -> None:
+    """
+    Computes language and sentiment score of every distinct review in parallel
+    and writes them, keyed by review digest, to a parquet file loaded by the app.
+    :param args: parsed command line arguments
+    :return: None
+    """
+    reviews = pre_process_reviews(read_source(args.source, "AllReviews"))
+    reviews["digest"] = [review_digest(text, rating) for text, rating in zip(reviews["text"], reviews["rating"])]
+    reviews = reviews.drop_duplicates(subset="digest")[["digest", "text", "rating"]]
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=warm_sentiment_worker) as executor:
+        scored = score_reviews_parallel(reviews, executor=executor, chunk_size=args.chunk_size)
+
+    scored[["digest", "language", "sentiment_score"]].to_parquet(args.output, index=False)
+    print(f"Scored {len(scored)} reviews into {args.output}")
+
+
+def snapshot(args: argparse.Namespace) -> None:
+    """
+    Pre-processes listings and reviews and stores them as the parquet snapshot the app starts from.
+    :param args: parsed command line arguments
+    :return: None
+    """
+    # the app may refresh the same snapshot, the watermark is read and the snapshot written under one lock
+    with snapshot_lock(args.output):
+        watermark = read_watermark(args.output) if args.incremental and snapshot_age(args.output) is not None \
+            else None
+        data = pre_process_listings_data(read_source(args.source, "Pharmacies"))
+        if watermark is None:
+            write_snapshot_chunks(data, pre_process_review_chunks(read_source_chunks(args.source, "AllReviews",
+                                                                                     args.chunk_size)), args.output)
+            print(f"Wrote {len(data)} pharmacies and {read_review_stats(args.output)['reviews'].sum()} reviews "
+                  f"to {args.output}")
+        else:
+            reviews_data = select_new_reviews(read_source(args.source, "AllReviews"), watermark)
+            append_snapshot(data, reviews_data, args.output)
+            print(f"Wrote {len(data)} pharmacies and {len(reviews_data)} new reviews to {args.output}")
+
+
+def memory(args: argparse.Namespace) -> None:
+    """
+    Reports the memory footprint of each column of the pre-processed tables, as pre-processing
+    returns them and in the compact dtypes the app loads them in.
+    :param args: parsed command line arguments
+    :return: None
+    """
+    data, reviews_data = pre_process_data(read_source(args.source, "Pharmacies"),
+                                          read_source(args.source, "AllReviews"))
+    for name, df, dtypes in (("Pharmacies", data, LISTINGS_DTYPES), ("AllReviews", reviews_data, REVIEWS_DTYPES)):
+        print(f"{name} ({len(df)} rows)")
+        print(memory_report(df, dtypes).to_string())
+        print()
+
+
+def wordclouds(args: argparse.Namespace) -> None:
+    """
+    Renders the wordcloud of every pharmacy in the snapshot into the wordcloud cache,
+    so that the Reviews Analytics tab does not render them on first view.
+    :param args: parsed command line arguments
+    :return: None
+    """
+    if snapshot_age(args.snapshot) is None:
+        raise SystemExit(f"No snapshot in {args.snapshot}, run `python cli.py snapshot` first")
+    counts, token_index = index_rows(read_token_counts(args.snapshot))
+    rendered = 0
+    for place in token_index:
+        # pharmacies without words to draw have no wordcloud
+        rendered += reviews_wordcloud_png(token_frequencies(counts, token_index, place), place) is not None
+    print(f"Rendered {rendered} wordclouds into {WORDCLOUD_CACHE_PATH}")
+
+
+def provision(args: argparse.Namespace) -> None:
+    """
+    Downloads the NLTK corpora used for sentiment scores, so that the app never needs network access for them.
+    :param args: parsed command line arguments
+    :return: None
+    """
+    provision_nltk_resources(args.output)
+    print(f"Installed {', '.join(NLTK_RESOURCES)} into {args.output}")
+
+
+def assets(args: argparse.Namespace) -> None:
+    """
+    Builds the WebP thumbnails shown on the list and review cards.
+    :param args: parsed command line arguments
+    :return: None
+    """
+    build_thumbnails(args.output)
+    print(f"Built {', '.join(THUMBNAILS)} thumbnails into {args.output}")
+
+
+def importtime(args: argparse.Namespace) -> None:
+    """
+    Measures the import time of the app modules in a fresh interpreter (python -X importtime)
+    and reports the cumulative time of each package they import, slowest first.
+    :param args: parsed command line arguments
+    :return: None
+    """
+    statement = "; ".join(f"import {module}" for module in args.modules)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, package = line.split("|")
+        # top-level packages only, their submodules are included in the cumulative time
+        name = package.strip().split(".")[0]
+        times[name] = max(times.get(name, 0), int(cumulative))
+    report = pd.Series(times, name="ms").div(1000).sort_values(ascending=False)
+    print(f"Import of {', '.join(args.modules)}")
+    print(report.head(args.top).round(1).to_string())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline jobs for the Pharmacies Listings app.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    score_parser = commands.add_parser("score", help="precompute language and sentiment score of all reviews")
+    score_parser.add_argument("--source", default="gsheets",
+                              help="'gsheets' (default) or a directory with an AllReviews.json export")
+    score_parser.add_argument("--output", default=SENTIMENT_SCORES_PATH, help="parquet file to write")
+    score_parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    score_parser.add_argument("--chunk-size", type=int, default=SENTIMENT_CHUNK_SIZE,
+                              help="reviews per worker task")
+    score_parser.set_defaults(func=score)
+
+    snapshot_parser = commands.add_parser("snapshot", help="write the pre-processed tables as a parquet snapshot")
+    snapshot_parser.add_argument("--source", default="gsheets",
+                                 help="'gsheets' (default) or a directory with Pharmacies.json and AllReviews.json")
+    snapshot_parser.add_argument("--output", default=SNAPSHOT_DIR, help="snapshot directory to write")
+    snapshot_parser.add_argument("--incremental", action="store_true",
+                                 help="only append the reviews newer than the watermark of an existing snapshot")
+    snapshot_parser.add_argument("--chunk-size", type=int, default=REVIEWS_CHUNK_SIZE,
+                                 help="reviews pre-processed and stored at once")
+    snapshot_parser.set_defaults(func=snapshot)
+
+    memory_parser = commands.add_parser("memory", help="report the memory footprint of the tables per column")
+    memory_parser.add_argument("--source", default="gsheets",
+                               help="'gsheets' (default) or a directory with Pharmacies.json and AllReviews.json")
+    memory_parser.set_defaults(func=memory)
+
+    wordclouds_parser = commands.add_parser("wordclouds", help="warm the wordcloud cache for all pharmacies")
+    wordclouds_parser.add_argument("--snapshot", default=SNAPSHOT_DIR, help="snapshot directory to read")
+    wordclouds_parser.set_defaults(func=wordclouds)
+
+    provision_parser = commands.add_parser("provision", help="download the NLTK corpora, e.g. when building an image")
+    provision_parser.add_argument("--output", default=NLTK_DATA_DIR, help="directory to install the corpora into")
+    provision_parser.set_defaults(func=provision)
+
+    assets_parser = commands.add_parser("assets", help="build the card thumbnails, e.g. when building an image")
+    assets_parser.add_argument("--output", default=THUMBNAIL_DIR, help="directory to write the thumbnails to")
+    assets_parser.set_defaults(func=assets)
+
+    importtime_parser = commands.add_parser("importtime", help="report the import time of the app modules per package")
+    importtime_parser.add_argument("--modules", nargs="+", default=STARTUP_MODULES,
+                                   help="modules to import, by default those the map and list views start with")
+    importtime_parser.add_argument("--top", type=int, default=20, help="number of packages to list")
+    importtime_parser.set_defaults(func=importtime)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
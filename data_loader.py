@@ -0,0 +1,542 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from typing import Tuple, Dict, Optional, List, Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+
+from filters import index_listings, rank_listings
+from tokens import token_counts
+from utils import pre_process_listings_data, pre_process_reviews, index_reviews, index_rows, \
+    index_ratings, attach_sentiment_scores, review_stats, merge_review_stats, pharmacy_kpis
+
+# Seconds the pre-processed tables stay cached before the sheets are fetched again.
+DATA_TTL_SECONDS = int(os.environ.get("DATA_TTL_SECONDS", 3600))
+# Directory holding the parquet snapshot of the pre-processed tables.
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "data/snapshot")
+# Bump whenever pre-processing changes the columns of the tables, so that older snapshots are ignored.
+SNAPSHOT_VERSION = 6
+# Once the snapshot is older than the TTL, ingest only the reviews newer than its watermark
+# instead of pre-processing the whole AllReviews worksheet again.
+INCREMENTAL_REVIEWS = os.environ.get("INCREMENTAL_REVIEWS", "1") == "1"
+# Maximum number of reviews pre-processed and stored at once by a full load.
+REVIEWS_CHUNK_SIZE = int(os.environ.get("REVIEWS_CHUNK_SIZE", 100_000))
+# Compact dtypes of the snapshot tables: low-cardinality columns as categoricals and small integers
+# downcast. Any other text column is held as an Arrow-backed string, see compact_frame.
+LISTINGS_DTYPES = {"city": "category", "canton": "category", "adjustedReview": "category",
+                   "markerColor": "category", "totalReviews": "int32", "adjustedRating": "int8"}
+# ratings are whole stars, missing ones are already filled with 0 by pre-processing
+REVIEWS_DTYPES = {"place_Name": "category", "rating": "int8"}
+TOKEN_COUNTS_DTYPES = {"place_Name": "category", "token": "category"}
+# Text columns whose missing values stay missing in the snapshot, any other one stores them as strings.
+# A pharmacy outside any canton must not become the canton 'None'.
+NULLABLE_COLUMNS = {"canton"}
+ARROW_STRING = pd.StringDtype("pyarrow")
+
+logger = logging.getLogger(__name__)
+
+
+def read_worksheet(worksheet: str) -> pd.DataFrame:
+    """
+    Fetches a raw worksheet from the Google Sheets connection, bypassing any cache.
+    :param worksheet: name of the worksheet, e.g. 'Pharmacies' or 'AllReviews'.
+    :return: DataFrame with the worksheet contents.
+    """
+    # imported here, starting from the snapshot does not need the Google Sheets client
+    from streamlit_gsheets import GSheetsConnection
+
+    conn = st.connection("gsheets", type=GSheetsConnection)
+    # ttl=0 so that the connection does not keep a second, possibly staler cache of the raw sheets
+    return conn.read(worksheet=worksheet, ttl=0)
+
+
+def fetch_new_reviews(watermark: Dict) -> pd.DataFrame:
+    """
+    Fetches the reviews added after the watermark and pre-processes only those.
+    :param watermark: watermark of the stored reviews, see reviews_watermark.
+    :return: pre-processed DataFrame with the new reviews, possibly empty.
+    """
+    # The Sheets API cannot filter rows server side, so the sheet is still downloaded, but only
+    # rows newer than the watermark are pre-processed. With the SQL source this becomes
+    # pd.read_sql_query('SELECT * FROM "Reviews" WHERE datetime >= %(since)s', ...)
+    reviews_data = read_worksheet("AllReviews")
+    return select_new_reviews(reviews_data, watermark)
+
+
+def select_new_reviews(reviews_data: pd.DataFrame, watermark: Dict) -> pd.DataFrame:
+    """
+    Pre-processes the rows of a raw reviews table that are not covered by the watermark.
+    :param reviews_data: raw reviews DataFrame, as read from the worksheet.
+    :param watermark: watermark of the stored reviews, see reviews_watermark.
+    :return: pre-processed DataFrame with the new reviews, possibly empty.
+    """
+    latest = pd.Timestamp(watermark["datetime"])
+    reviews_data = reviews_data[pd.to_datetime(reviews_data["datetime"]).ge(latest).to_numpy()]
+    reviews_data = pre_process_reviews(reviews_data.copy())
+    # reviews at the watermark itself may have been ingested already
+    seen = set(watermark["keys"])
+    at_latest = reviews_data["datetime"].eq(latest).to_numpy()
+    at_latest[at_latest] = [key in seen for key in review_keys(reviews_data[at_latest])]
+    return reviews_data[~at_latest]
+
+
+def review_keys(reviews_data: pd.DataFrame) -> List[str]:
+    """
+    Identifies reviews by pharmacy, reviewer, time and text, as the worksheet has no id column.
+    :param reviews_data: pre-processed reviews DataFrame.
+    :return: list with the key of each review.
+    """
+    return [hashlib.sha1(f"{place}\x1f{reviewer}\x1f{datetime.isoformat()}\x1f{text}".encode()).hexdigest()
+            for place, reviewer, datetime, text in zip(reviews_data["place_Name"], reviews_data["reviewer"],
+                                                       reviews_data["datetime"], reviews_data["text"])]
+
+
+def reviews_watermark(reviews_data: pd.DataFrame, watermark: Optional[Dict] = None) -> Optional[Dict]:
+    """
+    Computes the high-watermark of the ingested reviews: their latest 'datetime' and the keys
+    of the reviews at that time, so that reviews sharing the timestamp are not ingested twice.
+    :param reviews_data: pre-processed reviews DataFrame, e.g. the newly ingested reviews.
+    :param watermark: watermark before reviews_data was ingested, None for a full load.
+    :return: the new watermark, None if there are no reviews at all.
+    """
+    if len(reviews_data) == 0:
+        return watermark
+    latest = reviews_data["datetime"].max()
+    # chunks of a full load are not necessarily in 'datetime' order
+    if watermark is not None and pd.Timestamp(watermark["datetime"]) > latest:
+        return watermark
+    keys = set(review_keys(reviews_data[reviews_data["datetime"].eq(latest)]))
+    if watermark is not None and pd.Timestamp(watermark["datetime"]) == latest:
+        keys.update(watermark["keys"])
+    return {"datetime": latest.isoformat(), "keys": sorted(keys)}
+
+
+def _generation_files(generation: str) -> Tuple[str, str, str, str, str]:
+    # reviews and their token counts are directories of parquet parts, one per ingested chunk,
+    # each read back as a single table
+    return (os.path.join(generation, f"Pharmacies.v{SNAPSHOT_VERSION}.parquet"),
+            os.path.join(generation, f"AllReviews.v{SNAPSHOT_VERSION}"),
+            os.path.join(generation, f"ReviewStats.v{SNAPSHOT_VERSION}.parquet"),
+            os.path.join(generation, f"watermark.v{SNAPSHOT_VERSION}.json"),
+            os.path.join(generation, f"TokenCounts.v{SNAPSHOT_VERSION}"))
+
+
+def _current_file(path: str) -> str:
+    # names the generation directory readers use, replaced atomically by every write
+    return os.path.join(path, f"CURRENT.v{SNAPSHOT_VERSION}")
+
+
+def _current_generation(path: str) -> Optional[str]:
+    try:
+        with open(_current_file(path)) as f:
+            return os.path.join(path, f.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+def _snapshot_files(path: str, generation: Optional[str] = None) -> Tuple[str, str, str, str, str]:
+    # files of the given generation, by default the current one, none of them exists while there is no snapshot
+    return _generation_files(generation or _current_generation(path) or os.path.join(path, "none"))
+
+
+def _new_generation(path: str) -> str:
+    generation = os.path.join(path, f"snapshot.v{SNAPSHOT_VERSION}.{time.time_ns()}")
+    for directory in _generation_files(generation)[1::3]:
+        os.makedirs(directory)
+    return generation
+
+
+def _publish_generation(path: str, generation: str) -> None:
+    # readers switch to the new generation at once, the previous one stays for readers still using it
+    previous = _current_generation(path)
+    with open(f"{_current_file(path)}.tmp", "w") as f:
+        f.write(os.path.basename(generation))
+    os.replace(f"{_current_file(path)}.tmp", _current_file(path))
+    keep = {generation, previous}
+    for name in os.listdir(path):
+        directory = os.path.join(path, name)
+        if name.startswith(f"snapshot.v{SNAPSHOT_VERSION}.") and directory not in keep:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+@contextmanager
+def snapshot_lock(path: str = SNAPSHOT_DIR) -> Iterator[None]:
+    """
+    Holds an exclusive lock on a snapshot directory, so that the app and `cli.py snapshot` never update it at the
+    same time. Take it around reading the watermark and writing, see refresh_snapshot.
+    :param path: snapshot directory.
+    :return: context manager holding the lock
+    """
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _write_reviews_part(reviews_data: pd.DataFrame, generation: str) -> None:
+    # the reviews and their token counts, so that review texts are tokenized only once
+    _, reviews_dir, _, _, tokens_dir = _generation_files(generation)
+    part = len([file for file in os.listdir(reviews_dir) if file.endswith(".parquet")])
+    _write_parquet(reviews_data, os.path.join(reviews_dir, f"part-{part:05d}.parquet"), REVIEWS_DTYPES)
+    _write_parquet(token_counts(reviews_data), os.path.join(tokens_dir, f"part-{part:05d}.parquet"),
+                   TOKEN_COUNTS_DTYPES)
+
+
+def compact_frame(df: pd.DataFrame, dtypes: Dict[str, str]) -> pd.DataFrame:
+    """
+    Converts a pre-processed table to the compact dtypes it is kept in by the snapshot.
+    :param df: pre-processed listings or reviews DataFrame.
+    :param dtypes: LISTINGS_DTYPES or REVIEWS_DTYPES.
+    :return: DataFrame with the given dtypes and Arrow-backed strings for the other text columns.
+    """
+    text_columns = df.columns[df.dtypes == object]
+    compact_dtypes = {column: ARROW_STRING for column in text_columns}
+    compact_dtypes.update({column: dtype for column, dtype in dtypes.items() if column in df.columns})
+    # through str first, so that missing values stay 'nan' strings as before and filled ones, e.g. a
+    # blank 'place_Name' filled with 0, do not mix types, except in NULLABLE_COLUMNS
+    str_columns = [column for column in text_columns if column not in NULLABLE_COLUMNS]
+    return df.astype({column: str for column in str_columns}).astype(compact_dtypes)
+
+
+def memory_report(df: pd.DataFrame, dtypes: Dict[str, str]) -> pd.DataFrame:
+    """
+    Compares the memory footprint of a pre-processed table with that of its compact form.
+    :param df: pre-processed listings or reviews DataFrame.
+    :param dtypes: LISTINGS_DTYPES or REVIEWS_DTYPES.
+    :return: DataFrame with the dtype and the bytes of each column before and after compact_frame,
+    and a 'total' row.
+    """
+    compact = compact_frame(df, dtypes)
+    report = pd.DataFrame({"dtype": df.dtypes.astype(str), "bytes": df.memory_usage(index=False, deep=True),
+                           "compactDtype": compact.dtypes.astype(str),
+                           "compactBytes": compact.memory_usage(index=False, deep=True)})
+    report.loc["total"] = ["", report["bytes"].sum(), "", report["compactBytes"].sum()]
+    return report
+
+
+def _read_parquet(path: str) -> pd.DataFrame:
+    # strings are converted straight from Arrow, without going through Python objects
+    return pq.read_table(path).to_pandas(types_mapper={pa.string(): ARROW_STRING, pa.large_string(): ARROW_STRING}.get)
+
+
+def _write_parquet(df: pd.DataFrame, file: str, dtypes: Dict[str, str]) -> None:
+    # written under a hidden temporary name first, so readers never see a partial file
+    temporary_file = os.path.join(os.path.dirname(file), f".{os.path.basename(file)}.tmp")
+    compact_frame(df, dtypes).to_parquet(temporary_file, index=not isinstance(df.index, pd.RangeIndex))
+    os.replace(temporary_file, file)
+
+
+def _write_watermark(watermark: Optional[Dict], file: str) -> None:
+    with open(f"{file}.tmp", "w") as f:
+        json.dump(watermark, f)
+    os.replace(f"{file}.tmp", file)
+
+
+def write_snapshot(data: pd.DataFrame, reviews_data: pd.DataFrame, path: str = SNAPSHOT_DIR) -> None:
+    """
+    Stores the pre-processed tables as parquet files, replacing any previous snapshot,
+    together with the per-pharmacy review totals and the reviews watermark.
+    The tables are stored in their compact dtypes, see compact_frame.
+    :param data: pre-processed listings DataFrame.
+    :param reviews_data: pre-processed reviews DataFrame.
+    :param path: snapshot directory.
+    :return: None
+    """
+    write_snapshot_chunks(data, [reviews_data], path)
+
+
+def write_snapshot_chunks(data: pd.DataFrame, review_chunks: Iterable[pd.DataFrame], path: str = SNAPSHOT_DIR) -> None:
+    """
+    Same as write_snapshot, with the reviews given as pre-processed chunks, see pre_process_review_chunks.
+    Each chunk is written as its own part as soon as it arrives, so only one chunk is held in memory.
+    The snapshot is built in a new generation directory that replaces the current one once complete,
+    call it while holding snapshot_lock.
+    :param data: pre-processed listings DataFrame.
+    :param review_chunks: iterable of pre-processed reviews DataFrames.
+    :param path: snapshot directory.
+    :return: None
+    """
+    os.makedirs(path, exist_ok=True)
+    generation = _new_generation(path)
+    listings_file, _, stats_file, watermark_file, _ = _generation_files(generation)
+    stats, watermark = None, None
+    for reviews_data in review_chunks:
+        _write_reviews_part(reviews_data, generation)
+        chunk_stats = review_stats(reviews_data)
+        stats = chunk_stats if stats is None else merge_review_stats(stats, chunk_stats)
+        watermark = reviews_watermark(reviews_data, watermark)
+    _write_parquet(stats, stats_file, {})
+    _write_parquet(data, listings_file, LISTINGS_DTYPES)
+    _write_watermark(watermark, watermark_file)
+    _publish_generation(path, generation)
+
+
+def split_reviews(reviews_data: pd.DataFrame, chunk_size: int = REVIEWS_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Splits an in-memory raw reviews table, e.g. a downloaded worksheet, into chunks.
+    :param reviews_data: raw reviews DataFrame.
+    :param chunk_size: maximum number of rows per chunk.
+    :return: iterator over the chunks, at least one even if the table is empty.
+    """
+    for start in range(0, max(len(reviews_data), 1), chunk_size):
+        yield reviews_data.iloc[start:start + chunk_size].copy()
+
+
+def read_review_chunks(file: str, chunk_size: int = REVIEWS_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Streams a raw reviews export from disk in chunks, without loading it whole.
+    Text exports are read as strings, missing values aside, as the dtypes guessed from each chunk
+    on its own could differ between parts, e.g. for a 'reviewer' column made only of digits in some chunks.
+    Pre-processing converts the columns it needs.
+    :param file: '.csv', '.jsonl' (one review per line) or '.parquet' file.
+    :param chunk_size: maximum number of rows per chunk.
+    :return: iterator over the raw chunks.
+    """
+    if file.endswith(".parquet"):
+        # one schema for the whole file
+        for batch in pq.ParquetFile(file).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    elif file.endswith(".jsonl"):
+        with pd.read_json(file, lines=True, chunksize=chunk_size, dtype=False, convert_dates=False) as reader:
+            for reviews_data in reader:
+                yield reviews_data.astype(str).where(reviews_data.notna())
+    else:
+        with pd.read_csv(file, chunksize=chunk_size, dtype=str) as reader:
+            yield from reader
+
+
+def pre_process_review_chunks(review_chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """
+    Pre-processes raw reviews chunk by chunk, see utils.pre_process_reviews.
+    :param review_chunks: iterable of raw reviews DataFrames.
+    :return: iterator over the pre-processed chunks, each one sorted by 'datetime'.
+    """
+    for reviews_data in review_chunks:
+        yield pre_process_reviews(reviews_data)
+
+
+def append_snapshot(data: pd.DataFrame, new_reviews: pd.DataFrame, path: str = SNAPSHOT_DIR) -> None:
+    """
+    Updates a snapshot with newly ingested reviews: they are stored as a new part along with their
+    token counts, the per-pharmacy totals are merged and the watermark advances.
+    The listings table, which is small, is replaced.
+    The update is built in a new generation directory, with the stored parts hard-linked into it,
+    that replaces the current one once complete. Call it while holding snapshot_lock.
+    :param data: pre-processed listings DataFrame.
+    :param new_reviews: pre-processed reviews that are newer than the snapshot watermark.
+    :param path: snapshot directory.
+    :return: None
+    """
+    current = _snapshot_files(path)
+    generation = _new_generation(path)
+    listings_file, _, stats_file, watermark_file, _ = _generation_files(generation)
+    # stored parts never change, the new generation shares them
+    for source, target in zip(current[1::3], _generation_files(generation)[1::3]):
+        for file in os.listdir(source):
+            if file.endswith(".parquet"):
+                os.link(os.path.join(source, file), os.path.join(target, file))
+    stats = pd.read_parquet(current[2])
+    if len(new_reviews) > 0:
+        _write_reviews_part(new_reviews, generation)
+        stats = merge_review_stats(stats, review_stats(new_reviews))
+    _write_parquet(stats, stats_file, {})
+    _write_parquet(data, listings_file, LISTINGS_DTYPES)
+    # always rewritten, its modification time tells the age of the snapshot
+    _write_watermark(reviews_watermark(new_reviews, read_watermark(path)), watermark_file)
+    _publish_generation(path, generation)
+
+
+def read_watermark(path: str = SNAPSHOT_DIR) -> Optional[Dict]:
+    """
+    Reads the watermark of the reviews stored in a snapshot.
+    :param path: snapshot directory.
+    :return: dict with the latest review 'datetime' and the 'keys' of the reviews at that time,
+    None if the snapshot has no reviews.
+    """
+    with open(_snapshot_files(path)[3]) as f:
+        return json.load(f)
+
+
+def snapshot_age(path: str = SNAPSHOT_DIR, generation: Optional[str] = None) -> Optional[float]:
+    """
+    :param path: snapshot directory.
+    :param generation: generation directory, see read_generation, the current one by default.
+    :return: seconds since the snapshot was last written or appended to, None if there is no snapshot.
+    """
+    files = _snapshot_files(path, generation)
+    if not all(os.path.exists(file) for file in files):
+        return None
+    return time.time() - min(os.path.getmtime(file) for file in (files[0], files[3]))
+
+
+def read_snapshot(path: str = SNAPSHOT_DIR, max_age: Optional[float] = None,
+                  generation: Optional[str] = None) -> Optional[Tuple[pd.DataFrame, pd.DataFrame]]:
+    """
+    Reads the tables stored by write_snapshot and append_snapshot.
+    :param path: snapshot directory.
+    :param max_age: maximum age of the snapshot in seconds, None accepts any age.
+    :param generation: generation directory, see read_generation, the current one by default.
+    :return: A tuple containing pre-processed DataFrames for listings and reviews,
+    or None if there is no snapshot or it is too old.
+    """
+    age = snapshot_age(path, generation)
+    if age is None or (max_age is not None and age > max_age):
+        return None
+    listings_file, reviews_dir = _snapshot_files(path, generation)[:2]
+    data, reviews_data = _read_parquet(listings_file), _read_parquet(reviews_dir)
+    return data, reviews_data
+
+
+def read_review_stats(path: str = SNAPSHOT_DIR, generation: Optional[str] = None) -> pd.DataFrame:
+    """
+    Reads the per-pharmacy review totals kept up to date by write_snapshot and append_snapshot.
+    :param path: snapshot directory.
+    :param generation: generation directory, see read_generation, the current one by default.
+    :return: DataFrame as returned by utils.review_stats.
+    """
+    return pd.read_parquet(_snapshot_files(path, generation)[2])
+
+
+def read_token_counts(path: str = SNAPSHOT_DIR, generation: Optional[str] = None) -> pd.DataFrame:
+    """
+    Reads the token counts of all reviews in a snapshot.
+    :param path: snapshot directory.
+    :param generation: generation directory, see read_generation, the current one by default.
+    :return: DataFrame as returned by tokens.token_counts, for all parts.
+    """
+    return _read_parquet(_snapshot_files(path, generation)[4])
+
+
+def read_generation(path: str = SNAPSHOT_DIR) -> Optional[Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame,
+                                                                pd.DataFrame]]:
+    """
+    Reads all tables of a snapshot from one generation, so that they match each other
+    even if a writer publishes a new generation in the meantime.
+    :param path: snapshot directory.
+    :return: A tuple containing the listings, the reviews, the review totals (see read_review_stats)
+    and the token counts (see read_token_counts), or None if there is no snapshot.
+    """
+    while True:
+        generation = _current_generation(path)
+        if generation is None:
+            return None
+        try:
+            snapshot = read_snapshot(path, generation=generation)
+            if snapshot is None:
+                raise FileNotFoundError(generation)
+            return (*snapshot, read_review_stats(path, generation), read_token_counts(path, generation))
+        except (OSError, pa.ArrowException):
+            # a generation is only removed once two newer ones are published, see _publish_generation,
+            # the newest one is read instead
+            if _current_generation(path) == generation:
+                raise
+
+
+def refresh_snapshot(path: str = SNAPSHOT_DIR, max_age: Optional[float] = None) -> None:
+    """
+    Brings the snapshot up to date with the remote source. Reviews are ingested incrementally
+    when INCREMENTAL_REVIEWS is set and a snapshot with a watermark exists, otherwise
+    both tables are fetched and pre-processed in full, reviews in chunks of REVIEWS_CHUNK_SIZE.
+    :param path: snapshot directory.
+    :param max_age: nothing is fetched if another writer left a snapshot younger than this many seconds
+    while waiting for snapshot_lock, None always fetches.
+    :return: None
+    """
+    with snapshot_lock(path):
+        age = snapshot_age(path)
+        if age is not None and max_age is not None and age <= max_age:
+            return
+        watermark = read_watermark(path) if INCREMENTAL_REVIEWS and age is not None else None
+        if watermark is None:
+            data = pre_process_listings_data(read_worksheet("Pharmacies"))
+            # the worksheet arrives in one piece, but is pre-processed and stored a chunk at a time
+            write_snapshot_chunks(data, pre_process_review_chunks(split_reviews(read_worksheet("AllReviews"))),
+                                  path)
+        else:
+            append_snapshot(pre_process_listings_data(read_worksheet("Pharmacies")), fetch_new_reviews(watermark),
+                            path)
+
+
+@st.cache_resource(ttl=DATA_TTL_SECONDS, show_spinner="Loading pharmacies data...")
+def load_data() -> Tuple[pd.DataFrame, pd.DataFrame, Dict[str, Tuple[int, int]],
+                         Dict[str, Tuple[np.ndarray, np.ndarray]], pd.DataFrame, pd.DataFrame,
+                         Dict[str, Tuple[int, int]], str]:
+    """
+    Loads pharmacy listings and reviews and pre-processes them once per TTL.
+    A snapshot younger than the TTL is used as is, otherwise it is first refreshed from
+    the remote source, see refresh_snapshot. If that fails, an older snapshot, e.g. one built
+    into the image by cli.py snapshot, is served until the next load.
+    All tables are read from the same generation of the snapshot, see read_generation.
+    The tables are shared by all sessions without being copied on every rerun, they must not be modified:
+    views copy the rows they change first.
+    :return: A tuple containing pre-processed DataFrames for listings and reviews, with reviews
+    grouped per pharmacy, the review index mapping each pharmacy to its rows (see utils.index_reviews),
+    the rating index of the rows of each pharmacy (see utils.index_ratings), the KPIs of each pharmacy
+    (see utils.pharmacy_kpis), the token counts grouped per pharmacy for tokens.token_frequencies with
+    the dict mapping each pharmacy to its rows, and the version of the listings (see listings_version).
+    """
+    age = snapshot_age()
+    if age is None or age > DATA_TTL_SECONDS:
+        try:
+            refresh_snapshot(max_age=DATA_TTL_SECONDS)
+        except Exception:
+            if snapshot_age() is None:
+                raise
+            logger.warning("Could not refresh the snapshot, serving the stale one", exc_info=True)
+    data, reviews_data, stats, counts = read_generation()
+
+    reviews_data = attach_sentiment_scores(reviews_data)
+    reviews_data, review_index = index_reviews(reviews_data)
+    rating_index = index_ratings(reviews_data, review_index)
+    # the stored totals are kept up to date by every snapshot write, no pass over the reviews needed
+    kpis = pharmacy_kpis(stats)
+    counts, token_index = index_rows(counts)
+    return data, reviews_data, review_index, rating_index, kpis, counts, token_index, listings_version(data)
+
+
+def listings_version(data: pd.DataFrame) -> str:
+    """
+    :param data: The pre-processed listings DataFrame.
+    :return: hex digest of the listings, changes whenever any of their rows does.
+    """
+    return hashlib.sha1(pd.util.hash_pandas_object(data, index=False).to_numpy()).hexdigest()
+
+
+@st.cache_resource(ttl=DATA_TTL_SECONDS, show_spinner=False)
+def load_listing_index(version: str,
+                       _data: pd.DataFrame) -> Tuple[Dict[str, Tuple[Dict, np.ndarray, np.ndarray]], np.ndarray]:
+    """
+    Indexes the listings returned by load_data once per version for filters.filter_listings.
+    Like load_data, the index is shared by all sessions without being copied, it must not be modified.
+    :param version: version of the listings returned by load_data, the cache key.
+    :param _data: the listings returned by load_data, not hashed by streamlit.
+    :return: A tuple containing the index of filters.FILTER_COLUMNS (see filters.index_listings)
+    and the List View order of the listings (see filters.rank_listings).
+    """
+    return index_listings(_data), rank_listings(_data)
+
+
+def invalidate_data() -> None:
+    """
+    Drops the cached tables and the snapshot so that the next call to load_data
+    fetches and pre-processes them again.
+    :return: None
+    """
+    with snapshot_lock(SNAPSHOT_DIR):
+        # without a current generation there is no snapshot, the next write removes the old generations
+        if os.path.exists(_current_file(SNAPSHOT_DIR)):
+            os.remove(_current_file(SNAPSHOT_DIR))
+    load_data.clear()
+    load_listing_index.clear()
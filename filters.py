@@ -0,0 +1,74 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Listing columns the Map and List View filters select on.
+FILTER_COLUMNS = ["adjustedRating", "adjustedReview", "city", "name", "address"]
+
+
+def index_listings(data: pd.DataFrame,
+                   columns: List[str] = FILTER_COLUMNS) -> Dict[str, Tuple[Dict[Any, int], np.ndarray, np.ndarray]]:
+    """
+    Builds an inverted index of the listings for filter_listings: the row positions holding each value of a column
+    are stored as one contiguous block, so that selecting a value never scans the column.
+
+    :param data: The pre-processed listings DataFrame.
+    :param columns: columns to index, FILTER_COLUMNS by default.
+    :return: dict mapping each column to a tuple of a dict numbering its distinct values in order of appearance,
+    the row positions grouped per value and their bounds: the rows holding the value numbered i are
+    positions[bounds[i]:bounds[i + 1]].
+    """
+    index = {}
+    for column in columns:
+        codes, values = pd.factorize(data[column])
+        positions = np.argsort(codes, kind="stable").astype(np.int32)
+        # missing values have the code -1 and are sorted first, no filter selects them
+        bounds = np.bincount(codes + 1, minlength=len(values) + 1).cumsum()
+        index[column] = ({value: code for code, value in enumerate(values)}, positions, bounds)
+    return index
+
+
+def rank_listings(data: pd.DataFrame) -> np.ndarray:
+    """
+    Orders the listings the way the List View shows them, most reviewed and then best rated first.
+    Listings with missing values are left out, a missing 'canton' aside: pharmacies that could not be placed
+    in a canton are still listed.
+
+    :param data: The pre-processed listings DataFrame.
+    :return: row positions of the complete listings, in List View order.
+    """
+    complete = data.drop(columns="canton", errors="ignore").notna().all(axis=1).to_numpy()
+    order = np.lexsort((-data["averageRating"].to_numpy(), -data["totalReviews"].to_numpy()))
+    return order[complete[order]].astype(np.int32)
+
+
+def filter_listings(listing_index: Dict[str, Tuple[Dict[Any, int], np.ndarray, np.ndarray]],
+                    filters: Dict[str, Optional[Iterable]], order: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Answers a combination of filters from the index built by index_listings, without copying the listings:
+    the rows of the selected values of each column are marked in a boolean mask and the masks are ANDed.
+
+    :param listing_index: the index returned by index_listings.
+    :param filters: dict mapping columns to the values to keep, columns mapped to None or no values keep all rows.
+    :param order: row positions to return the matching rows in, e.g. rank_listings, all rows in row order by default.
+    :return: positions of the matching rows, to be sliced with DataFrame.iloc.
+    """
+    size = len(next(iter(listing_index.values()))[1])
+    mask = None
+    for column, selected in filters.items():
+        if selected is None or len(selected) == 0:
+            continue
+        codes, positions, bounds = listing_index[column]
+        column_mask = np.zeros(size, dtype=bool)
+        for value in selected:
+            code = codes.get(value)
+            if code is not None:  # values that are not listed match no row
+                column_mask[positions[bounds[code]:bounds[code + 1]]] = True
+        if mask is None:
+            mask = column_mask
+        else:
+            mask &= column_mask
+    if order is None:
+        return np.arange(size) if mask is None else np.flatnonzero(mask)
+    return order if mask is None else order[mask[order]]
@@ -0,0 +1,267 @@
+import json
+import math
+import os
+import unicodedata
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+CANTONS_GEOJSON_PATH = "data/georef-switzerland-kanton.geojson"
+# Douglas-Peucker tolerance in degrees per level of detail, 0 keeps the original geometry.
+GEOMETRY_TOLERANCES = {"low": 0.01, "medium": 0.002, "high": 0.0005, "full": 0}
+# Forces one level of detail for all maps, by default it is chosen from the map zoom.
+GEOMETRY_DETAIL = os.environ.get("GEOMETRY_DETAIL")
+# Cell size in degrees of the grid index used to locate points in cantons.
+CANTON_GRID_CELL = 0.02
+# Canton ('kan_name') of city names that are not a canton name themselves:
+# other languages, canton capitals and large cities, as written after the postal code of an address.
+CANTON_ALIASES = {
+    "Genf": "Genève", "Geneva": "Genève", "Ginevra": "Genève",
+    "Berne": "Bern", "Biel/Bienne": "Bern", "Biel": "Bern", "Bienne": "Bern", "Thun": "Bern", "Köniz": "Bern",
+    "Zurich": "Zürich", "Winterthur": "Zürich", "Uster": "Zürich",
+    "Basel": "Basel-Stadt", "Bâle": "Basel-Stadt", "Liestal": "Basel-Landschaft",
+    "Lucerne": "Luzern", "Gallen": "St. Gallen", "Sankt Gallen": "St. Gallen",
+    "Freiburg": "Fribourg", "Neuenburg": "Neuchâtel", "Chaux-de-Fonds": "Neuchâtel",
+    "Lausanne": "Vaud", "Waadt": "Vaud", "Sion": "Valais", "Sitten": "Valais", "Wallis": "Valais",
+    "Lugano": "Ticino", "Bellinzona": "Ticino", "Tessin": "Ticino",
+    "Chur": "Graubünden", "Grisons": "Graubünden", "Delémont": "Jura", "Aarau": "Aargau",
+    "Frauenfeld": "Thurgau", "Herisau": "Appenzell Ausserrhoden", "Appenzell": "Appenzell Innerrhoden",
+    "Stans": "Nidwalden", "Sarnen": "Obwalden", "Altdorf": "Uri", "Soleure": "Solothurn",
+}
+
+
+@lru_cache(maxsize=1)
+def load_cantons() -> dict:
+    """
+    Loads the Swiss cantons GeoJSON once per process.
+    The returned dict is shared, callers must not modify it.
+    :return: GeoJSON FeatureCollection of the cantons at full resolution.
+    """
+    with open(CANTONS_GEOJSON_PATH) as response:
+        return json.load(response)
+
+
+def detail_for_zoom(zoom: float) -> str:
+    """
+    Chooses the level of detail of the cantons geometry for a map zoom level.
+    :param zoom: mapbox zoom level of the map.
+    :return: key of GEOMETRY_TOLERANCES, overridden by GEOMETRY_DETAIL if set.
+    """
+    if GEOMETRY_DETAIL:
+        return GEOMETRY_DETAIL
+    if zoom < 7:
+        return "low"
+    if zoom < 9:
+        return "medium"
+    return "high"
+
+
+@lru_cache(maxsize=None)
+def cantons_geojson(detail: str = "medium") -> dict:
+    """
+    Returns the cantons GeoJSON simplified and with coordinates rounded for the given level of detail.
+    Only the 'kan_name' and 'kan_code' properties are kept. Results are cached per level of detail
+    and shared, callers must not modify them.
+    :param detail: key of GEOMETRY_TOLERANCES.
+    :return: GeoJSON FeatureCollection of the cantons.
+    """
+    tolerance = GEOMETRY_TOLERANCES[detail]
+    # round to roughly a tenth of the tolerance, coordinates beyond that carry no visible detail
+    decimals = math.ceil(-math.log10(tolerance)) + 1 if tolerance else None
+
+    features = []
+    for feature in load_cantons()["features"]:
+        geometry = feature["geometry"]
+        polygons = geometry["coordinates"] if geometry["type"] == "MultiPolygon" else [geometry["coordinates"]]
+        simplified = []
+        for polygon in polygons:
+            rings = [_simplify_ring(np.asarray(ring), tolerance, decimals) for ring in polygon]
+            # an exterior ring collapsing below a triangle drops the whole polygon, a hole only itself
+            if rings[0] is not None:
+                simplified.append([ring for ring in rings if ring is not None])
+        if not simplified:
+            simplified = polygons
+        features.append({
+            "type": "Feature",
+            "properties": {key: feature["properties"][key] for key in ("kan_name", "kan_code")},
+            "geometry": {"type": "MultiPolygon", "coordinates": simplified},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def _simplify_ring(ring: np.ndarray, tolerance: float, decimals: Optional[int]) -> Optional[list]:
+    """
+    Simplifies a closed ring with the Douglas-Peucker algorithm and rounds its coordinates.
+    :param ring: array of shape (n, 2) with longitude, latitude pairs, first equal to last.
+    :param tolerance: maximum distance in degrees of a dropped point to the simplified ring.
+    :param decimals: decimals to round coordinates to, None keeps them.
+    :return: list of [lon, lat] pairs, or None if fewer than 4 points remain.
+    """
+    keep = np.zeros(len(ring), dtype=bool)
+    keep[[0, -1]] = True
+    if tolerance == 0:
+        keep[:] = True
+    stack = [(0, len(ring) - 1)]
+    while stack and tolerance:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        points = ring[start + 1:end]
+        direction = ring[end] - ring[start]
+        length = np.hypot(*direction)
+        if length == 0:
+            distances = np.hypot(*(points - ring[start]).T)
+        else:
+            distances = np.abs(np.cross(direction, points - ring[start])) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            index = start + 1 + farthest
+            keep[index] = True
+            stack.extend([(start, index), (index, end)])
+
+    simplified = ring[keep]
+    if decimals is not None:
+        simplified = simplified.round(decimals)
+        # drop points that became duplicates after rounding
+        simplified = simplified[np.r_[True, np.any(np.diff(simplified, axis=0) != 0, axis=1)]]
+    if len(simplified) < 4:
+        return None
+    return simplified.tolist()
+
+
+def _normalize_name(name: str) -> str:
+    return "".join(char for char in unicodedata.normalize("NFKD", str(name).strip().casefold())
+                   if not unicodedata.combining(char))
+
+
+@lru_cache(maxsize=1)
+def _canton_lookup() -> dict:
+    """
+    Builds the lookup of normalized canton names and CANTON_ALIASES to 'kan_name' once per process.
+    :return: dict mapping normalized names to 'kan_name'.
+    """
+    lookup = {_normalize_name(alias): canton for alias, canton in CANTON_ALIASES.items()}
+    lookup.update({_normalize_name(feature["properties"]["kan_name"]): feature["properties"]["kan_name"]
+                   for feature in load_cantons()["features"]})
+    return lookup
+
+
+def assign_cantons(cities: pd.Series) -> pd.Series:
+    """
+    Maps city names to the 'kan_name' of their canton, looking up every distinct city once.
+    :param cities: Series of city names, e.g. the 'city' column of the listings.
+    :return: Series of canton names, NaN where the city is unknown.
+    """
+    lookup = _canton_lookup()
+    return cities.map({city: lookup.get(_normalize_name(city)) for city in cities.unique()}).astype(object)
+
+
+@lru_cache(maxsize=1)
+def _canton_grid() -> dict:
+    """
+    Builds a grid index over the full resolution cantons once per process.
+    Cells crossed by no border get the canton containing their center, the other cells
+    list the cantons crossing them or containing their center as candidates.
+    Cantons are ordered by decreasing area, so that where polygons overlap (the Appenzells lie
+    within St. Gallen without a hole) the smaller, later canton wins.
+    :return: dict with the cantons' names and paths, grid origin and shape, the canton of every cell
+    (-1 for cells crossed by a border, len(names) for none) and a cells x cantons matrix of candidates.
+    """
+    # only needed while pre-processing listings, matplotlib is not imported at app startup
+    from matplotlib.path import Path
+
+    cantons = []
+    for feature in load_cantons()["features"]:
+        geometry = feature["geometry"]
+        polygons = geometry["coordinates"] if geometry["type"] == "MultiPolygon" else [geometry["coordinates"]]
+        polygons = [[np.asarray(ring, dtype=float) for ring in polygon] for polygon in polygons]
+        area = sum(_ring_area(polygon[0]) - sum(_ring_area(hole) for hole in polygon[1:]) for polygon in polygons)
+        cantons.append((area, feature["properties"]["kan_name"], [ring for polygon in polygons for ring in polygon]))
+    cantons.sort(key=lambda canton: -canton[0])
+    names = [name for _, name, _ in cantons]
+    rings = [canton_rings for _, _, canton_rings in cantons]
+    # compound path per canton, holes are handled by the even-odd crossing test
+    paths = [Path.make_compound_path(*(Path(ring, closed=True) for ring in canton_rings))
+             for canton_rings in rings]
+
+    vertices = np.concatenate([ring for canton_rings in rings for ring in canton_rings])
+    x0, y0 = vertices.min(axis=0) - CANTON_GRID_CELL
+    nx, ny = (np.ceil((vertices.max(axis=0) - (x0, y0)) / CANTON_GRID_CELL).astype(int) + 1)
+
+    crossings = np.zeros((nx * ny, len(names)), dtype=bool)
+    for canton, canton_rings in enumerate(rings):
+        for ring in canton_rings:
+            # mark every cell within the bounding box of each border segment
+            start = np.floor((ring[:-1] - (x0, y0)) / CANTON_GRID_CELL).astype(int)
+            end = np.floor((ring[1:] - (x0, y0)) / CANTON_GRID_CELL).astype(int)
+            low, high = np.minimum(start, end), np.maximum(start, end)
+            # segments are short compared to a cell, their box spans at most 2 x 2 cells ...
+            for ix, iy in ((low[:, 0], low[:, 1]), (low[:, 0], high[:, 1]),
+                           (high[:, 0], low[:, 1]), (high[:, 0], high[:, 1])):
+                crossings[iy * nx + ix, canton] = True
+            # ... except for a few long ones
+            long = (high - low > 1).any(axis=1)
+            for (ix0, iy0), (ix1, iy1) in zip(low[long], high[long]):
+                for iy in range(iy0, iy1 + 1):
+                    crossings[iy * nx + ix0:iy * nx + ix1 + 1, canton] = True
+    crossed = crossings.any(axis=1)
+
+    # consecutive cells of a row without borders lie in the same cantons, one center per run is tested
+    cells = np.arange(nx * ny)
+    run_start = ~crossed & ((cells % nx == 0) | np.r_[True, crossed[:-1]])
+    run = np.maximum.accumulate(np.where(run_start, cells, 0))
+    tested = np.flatnonzero(crossed | run_start)
+    centers = np.column_stack([x0 + (tested % nx + 0.5) * CANTON_GRID_CELL,
+                               y0 + (tested // nx + 0.5) * CANTON_GRID_CELL])
+    contains_center = np.zeros((nx * ny, len(names)), dtype=bool)
+    for canton, path in enumerate(paths):
+        (left, bottom), (right, top) = path.get_extents().get_points()
+        in_box = np.flatnonzero((centers[:, 0] >= left) & (centers[:, 0] <= right) &
+                                (centers[:, 1] >= bottom) & (centers[:, 1] <= top))
+        contains_center[tested[in_box], canton] = path.contains_points(centers[in_box])
+    contains_center[~crossed] = contains_center[run[~crossed]]
+
+    # candidates of a cell: cantons crossing it and the cantons around it
+    candidates = crossings | contains_center
+    smallest = len(names) - 1 - contains_center[:, ::-1].argmax(axis=1)
+    cells = np.where(contains_center.any(axis=1), smallest, len(names))
+    cells[crossed] = -1
+
+    return {"names": np.array(names + [None], dtype=object), "paths": paths, "origin": (x0, y0),
+            "shape": (nx, ny), "cells": cells, "candidates": candidates}
+
+
+def _ring_area(ring: np.ndarray) -> float:
+    x, y = ring.T
+    return abs(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1])) / 2
+
+
+def locate_cantons(latitude: pd.Series, longitude: pd.Series) -> pd.Series:
+    """
+    Finds the canton containing each point using the grid index of _canton_grid.
+    Points in cells without borders are resolved by lookup, the others are tested
+    against the candidate cantons of their cell only.
+    :param latitude: Series of latitudes.
+    :param longitude: Series of longitudes, aligned with latitude.
+    :return: Series of canton names ('kan_name'), None for points outside Switzerland.
+    """
+    grid = _canton_grid()
+    nx, ny = grid["shape"]
+    points = np.column_stack([longitude.to_numpy(dtype=float), latitude.to_numpy(dtype=float)])
+    ix, iy = np.floor((points - grid["origin"]) / CANTON_GRID_CELL).astype(int).T
+    on_grid = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    cell = np.where(on_grid, iy * nx + ix, 0)
+
+    # -1 marks points to test against the candidates of their cell, len(names) points outside of all cantons
+    cantons = np.where(on_grid, grid["cells"][cell], len(grid["paths"]))
+    pending = cantons == -1
+    cantons[pending] = len(grid["paths"])
+    candidates = grid["candidates"][cell] & pending[:, None]
+    # in order of decreasing area, so that smaller cantons win where polygons overlap
+    for canton in np.flatnonzero(candidates.any(axis=0)):
+        tested = np.flatnonzero(candidates[:, canton])
+        inside = grid["paths"][canton].contains_points(points[tested])
+        cantons[tested[inside]] = canton
+    return pd.Series(grid["names"][cantons], index=latitude.index)
@@ -0,0 +1,77 @@
+import base64
+import io
+import os
+from functools import lru_cache
+from typing import Dict, Tuple
+
+from PIL import Image
+
+from template.html import THUMBNAIL, THUMBNAIL_STYLE
+
+# Directory the thumbnails are built into by `python cli.py assets`.
+THUMBNAIL_DIR = os.environ.get("THUMBNAIL_DIR", "assets/thumbnails")
+# Source image and maximum width/height in pixels of each thumbnail, twice the size they are shown at.
+THUMBNAILS: Dict[str, Tuple[str, int]] = {
+    "pharmacy": ("assets/icon-min.png", 128),
+    "reviewer": ("assets/reviewer.png", 96),
+}
+
+
+def render_thumbnail(name: str) -> bytes:
+    """
+    Shrinks the source image of a thumbnail and encodes it as WebP.
+    :param name: key of THUMBNAILS
+    :return: WebP bytes of the thumbnail
+    """
+    source, size = THUMBNAILS[name]
+    with Image.open(source) as image:
+        image.thumbnail((size, size))
+        buffer = io.BytesIO()
+        image.save(buffer, format="WEBP", quality=85)
+    return buffer.getvalue()
+
+
+def build_thumbnails(directory: str = THUMBNAIL_DIR) -> None:
+    """
+    Writes all THUMBNAILS as WebP files, e.g. while building the app image.
+    :param directory: target directory, THUMBNAIL_DIR by default.
+    :return: None
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name in THUMBNAILS:
+        with open(os.path.join(directory, f"{name}.webp"), "wb") as f:
+            f.write(render_thumbnail(name))
+
+
+@lru_cache(maxsize=None)
+def thumbnail_bytes(name: str) -> bytes:
+    """
+    Loads a thumbnail once per process, from THUMBNAIL_DIR if it was built, otherwise from its source image.
+    :param name: key of THUMBNAILS
+    :return: WebP bytes of the thumbnail
+    """
+    file = os.path.join(THUMBNAIL_DIR, f"{name}.webp")
+    if os.path.exists(file):
+        with open(file, "rb") as f:
+            return f.read()
+    return render_thumbnail(name)
+
+
+@lru_cache(maxsize=None)
+def thumbnail_css() -> str:
+    """
+    Builds one style block holding every thumbnail as a data URI, to be rendered once per page
+    so that cards refer to the images by class instead of sending them again.
+    :return: HTML style element
+    """
+    rules = "".join(THUMBNAIL_STYLE.format(name, base64.b64encode(thumbnail_bytes(name)).decode("ascii"))
+                    for name in THUMBNAILS)
+    return f"<style>{rules}</style>"
+
+
+def thumbnail(name: str) -> str:
+    """
+    :param name: key of THUMBNAILS
+    :return: HTML element showing the thumbnail, see thumbnail_css.
+    """
+    return THUMBNAIL.format(name)
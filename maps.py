@@ -0,0 +1,124 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+import folium
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from filters import filter_listings
+from utils import create_map
+
+# Upper bound in bytes of the rendered map pages kept in memory, shared by all sessions.
+MAP_CACHE_MAX_BYTES = int(os.environ.get("MAP_CACHE_MAX_BYTES", 128 * 1024 ** 2))
+# Number of cities, those with the most pharmacies, whose maps are rendered ahead of the first visit.
+MAP_PREWARM_CITIES = int(os.environ.get("MAP_PREWARM_CITIES", 20))
+
+_map_cache: "OrderedDict[Tuple, str]" = OrderedDict()
+_map_cache_bytes = 0
+_map_cache_lock = threading.Lock()
+
+
+def map_cache_key(version: str, name: Iterable = (), address: Iterable = (), city: Iterable = ()) -> Tuple:
+    """
+    Normalizes a selection of the Map View filters: the map does not depend on the order values were selected in.
+    :param version: version of the listings, see data_loader.listings_version.
+    :param name: selected pharmacy names, none for all.
+    :param address: selected addresses, none for all.
+    :param city: selected cities, none for all.
+    :return: hashable cache key of the map
+    """
+    return version, tuple(sorted(name)), tuple(sorted(address)), tuple(sorted(city))
+
+
+def render_map(data: pd.DataFrame) -> str:
+    """
+    Renders the map of utils.create_map into the HTML page sent to the browser, as folium_static does.
+    :param data: The DataFrame containing pharmacy data.
+    :return: HTML page of the map
+    """
+    return folium.Figure().add_child(create_map(data)).render()
+
+
+def read_cached_map(key: Tuple) -> Optional[str]:
+    """
+    :param key: key returned by map_cache_key
+    :return: the cached HTML page of the map, None if it is not cached
+    """
+    with _map_cache_lock:
+        html = _map_cache.get(key)
+        if html is not None:
+            _map_cache.move_to_end(key)
+        return html
+
+
+def write_cached_map(key: Tuple, html: str) -> None:
+    """
+    Caches the HTML page of a map, evicting the least recently used pages above MAP_CACHE_MAX_BYTES.
+    Pages larger than the whole cache are not kept.
+    :param key: key returned by map_cache_key
+    :param html: HTML page of the map
+    :return: None
+    """
+    global _map_cache_bytes
+    size = len(html)
+    if size > MAP_CACHE_MAX_BYTES:
+        return
+    with _map_cache_lock:
+        if key in _map_cache:
+            _map_cache_bytes -= len(_map_cache.pop(key))
+        _map_cache[key] = html
+        _map_cache_bytes += size
+        while _map_cache_bytes > MAP_CACHE_MAX_BYTES:
+            _map_cache_bytes -= len(_map_cache.popitem(last=False)[1])
+
+
+def map_html(key: Tuple, data: pd.DataFrame, rows: np.ndarray) -> str:
+    """
+    Returns the HTML page of the map of some pharmacies, rendered only if it is not cached yet.
+    :param key: key returned by map_cache_key for the filters that selected the rows
+    :param data: The DataFrame containing pharmacy data.
+    :param rows: positions in data of the pharmacies to show, see filters.filter_listings.
+    :return: HTML page of the map
+    """
+    html = read_cached_map(key)
+    if html is None:
+        html = render_map(data.iloc[rows])
+        write_cached_map(key, html)
+    return html
+
+
+def _prewarm_maps(version: str, data: pd.DataFrame, listing_index: Dict) -> None:
+    """
+    Renders the map of all pharmacies, then those of the MAP_PREWARM_CITIES cities with the most pharmacies.
+    :param version: version of the listings
+    :param data: The DataFrame containing pharmacy data.
+    :param listing_index: index of the listings, see filters.index_listings.
+    :return: None
+    """
+    cities, _, bounds = listing_index["city"]
+    counts = np.diff(bounds)
+    largest = sorted(cities, key=lambda city: counts[cities[city]], reverse=True)
+    for city in [None, *largest[:MAP_PREWARM_CITIES]]:
+        selected = [] if city is None else [city]
+        key = map_cache_key(version, city=selected)
+        if read_cached_map(key) is None:
+            write_cached_map(key, render_map(data.iloc[filter_listings(listing_index, {"city": selected})]))
+
+
+@st.cache_resource(show_spinner=False)
+def prewarm_maps(version: str, _data: pd.DataFrame, _listing_index: Dict) -> threading.Thread:
+    """
+    Starts rendering the most visited maps in the background, once per version of the listings,
+    so that the Map View is served from the cache from its first visit on.
+    :param version: version of the listings returned by data_loader.load_data, the cache key.
+    :param _data: the listings returned by data_loader.load_data, not hashed by streamlit.
+    :param _listing_index: index of the listings returned by data_loader.load_listing_index.
+    :return: the started daemon thread
+    """
+    thread = threading.Thread(target=_prewarm_maps, args=(version, _data, _listing_index),
+                              name="map-prewarm", daemon=True)
+    thread.start()
+    return thread
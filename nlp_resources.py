@@ -0,0 +1,40 @@
+import os
+from functools import lru_cache
+
+import nltk
+from nltk.tokenize import punkt
+
+# Local directory the NLTK corpora are provisioned into by `python cli.py provision`.
+NLTK_DATA_DIR = os.environ.get("NLTK_DATA_DIR", "data/nltk_data")
+# punkt_tab replaced the pickled punkt models, which newer nltk versions no longer load.
+PUNKT = "punkt_tab" if hasattr(punkt, "PunktTokenizer") else "punkt"
+# NLTK packages needed for sentiment scores, with a path that must exist once a package is installed.
+NLTK_RESOURCES = {PUNKT: f"tokenizers/{PUNKT}/german" + ("/" if PUNKT == "punkt_tab" else ".pickle")}
+
+
+@lru_cache(maxsize=None)
+def ensure_nltk_resources() -> None:
+    """
+    Makes the corpora in NLTK_DATA_DIR available to nltk and checks that all NLTK_RESOURCES are there.
+    Nothing is downloaded, call it right before the first use of the corpora.
+    :return: None
+    """
+    directory = os.path.abspath(NLTK_DATA_DIR)
+    if directory not in nltk.data.path:
+        nltk.data.path.insert(0, directory)
+    for package, resource in NLTK_RESOURCES.items():
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            raise LookupError(f"NLTK package '{package}' is missing from {directory} and the NLTK_DATA paths, "
+                              f"run `python cli.py provision` to install it") from None
+
+
+def provision_nltk_resources(directory: str = NLTK_DATA_DIR) -> None:
+    """
+    Downloads all NLTK_RESOURCES into a directory, e.g. while building the app image.
+    :param directory: target directory, NLTK_DATA_DIR by default.
+    :return: None
+    """
+    for package in NLTK_RESOURCES:
+        nltk.download(package, download_dir=directory, quiet=True, raise_on_error=True)
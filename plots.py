@@ -1,11 +1,27 @@
-import json
+import hashlib
+import io
+import os
+import sqlite3
+import time
+from contextlib import closing
+from typing import Dict, Optional, TYPE_CHECKING
 
 import pandas as pd
 import plotly.graph_objects as go
-from matplotlib import pyplot as plt
-from wordcloud import WordCloud
 
-from utils import insert_sentiment_scores
+# matplotlib and wordcloud are only imported once a wordcloud is rendered
+if TYPE_CHECKING:
+    from matplotlib import pyplot as plt
+
+from geo import cantons_geojson, detail_for_zoom
+from utils import RATING_LABELS, insert_sentiment_scores
+
+# On-disk cache of rendered wordcloud PNGs per pharmacy, see reviews_wordcloud_png.
+WORDCLOUD_CACHE_PATH = os.environ.get("WORDCLOUD_CACHE_PATH", "data/wordcloud_cache.sqlite")
+# Least recently used wordclouds are evicted once the cached PNGs exceed this size.
+WORDCLOUD_CACHE_MAX_BYTES = int(os.environ.get("WORDCLOUD_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# Bump whenever reviews_wordcloud renders differently to invalidate cached images.
+WORDCLOUD_VERSION = "2"
 
 COLORS = ["#0081a7", "#00afb9", "#f07167", "#e9c46a",
           "#264653", "#f4a261", "#e76f51", "#ef233c", "#fed9b7"
@@ -35,15 +51,18 @@ def update_layout(fig: go.Figure, x_label: str, y_label: str, title: str) -> go.
     return fig
 
 
-def reviews_wordcloud(df: pd.DataFrame) -> plt.figure:
+def reviews_wordcloud(frequencies: Dict[str, int]) -> "plt.figure":
     """
-    Generate a word cloud to visualize frequent words in a DataFrame of reviews.
+    Generate a word cloud to visualize frequent words in reviews.
 
-    :param df: The input DataFrame containing review data.
+    :param frequencies: dict mapping words of the reviews to their number of occurrences,
+    see tokens.token_frequencies.
     :return: A matplotlib figure representing the word cloud
     """
-    wordcloud = WordCloud(background_color='white', min_font_size=5).generate(
-        ' '.join(df['text']))
+    from matplotlib import pyplot as plt
+    from wordcloud import WordCloud
+
+    wordcloud = WordCloud(background_color='white', min_font_size=5).generate_from_frequencies(frequencies)
 
     # Convert the word cloud to an image
     fig = plt.figure(facecolor=None)
@@ -55,6 +74,90 @@ def reviews_wordcloud(df: pd.DataFrame) -> plt.figure:
     return fig
 
 
+def wordcloud_digest(place: str, frequencies: Dict[str, int]) -> str:
+    """
+    Function to compute the cache key of a pharmacy's wordcloud from the word frequencies it is generated from.
+    :param place: name of the pharmacy
+    :param frequencies: dict mapping words to their number of occurrences
+    :return: hex digest of wordcloud version, pharmacy and word frequencies
+    """
+    digest = hashlib.sha256(f"{WORDCLOUD_VERSION}\x1f{place}".encode("utf-8"))
+    for word, count in sorted(frequencies.items()):
+        digest.update(f"\x1f{word}\x1f{count}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _connect_wordcloud_cache() -> sqlite3.Connection:
+    """
+    Opens the wordcloud cache database, creating its table on first use.
+    :return: sqlite3 connection to the cache file
+    """
+    conn = sqlite3.connect(WORDCLOUD_CACHE_PATH, timeout=30)
+    conn.execute("CREATE TABLE IF NOT EXISTS wordcloud "
+                 "(digest TEXT PRIMARY KEY, place TEXT, png BLOB, size INTEGER, accessed REAL)")
+    return conn
+
+
+def read_cached_wordcloud(digest: str) -> Optional[bytes]:
+    """
+    Function to look up a cached wordcloud and mark it as recently used.
+    :param digest: wordcloud digest as returned by wordcloud_digest
+    :return: PNG bytes of the wordcloud, None if it is not cached
+    """
+    with closing(_connect_wordcloud_cache()) as conn, conn:
+        row = conn.execute("SELECT png FROM wordcloud WHERE digest = ?", (digest,)).fetchone()
+        if row is not None:
+            conn.execute("UPDATE wordcloud SET accessed = ? WHERE digest = ?", (time.time(), digest))
+    return None if row is None else row[0]
+
+
+def write_cached_wordcloud(digest: str, place: str, png: bytes) -> None:
+    """
+    Function to persist a rendered wordcloud. Least recently used wordclouds, e.g. those of
+    reviews that changed since, are evicted to stay within WORDCLOUD_CACHE_MAX_BYTES.
+    :param digest: wordcloud digest as returned by wordcloud_digest
+    :param place: name of the pharmacy
+    :param png: PNG bytes of the wordcloud
+    :return: None
+    """
+    with closing(_connect_wordcloud_cache()) as conn, conn:
+        conn.execute("INSERT OR REPLACE INTO wordcloud (digest, place, png, size, accessed) VALUES (?, ?, ?, ?, ?)",
+                     (digest, place, png, len(png), time.time()))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM wordcloud").fetchone()[0]
+        for evicted, size in conn.execute("SELECT digest, size FROM wordcloud ORDER BY accessed").fetchall():
+            if total <= WORDCLOUD_CACHE_MAX_BYTES or evicted == digest:
+                break
+            conn.execute("DELETE FROM wordcloud WHERE digest = ?", (evicted,))
+            total -= size
+
+
+def reviews_wordcloud_png(frequencies: Dict[str, int], place: str) -> Optional[bytes]:
+    """
+    Renders the word cloud of reviews_wordcloud as PNG, reusing the cached image
+    as long as the word frequencies do not change.
+
+    :param frequencies: dict mapping words of the pharmacy's reviews to their number of occurrences.
+    :param place: name of the pharmacy
+    :return: PNG bytes of the word cloud figure, None if the reviews have no words to draw
+    (no text, or only stopwords and numbers).
+    """
+    if not frequencies:
+        return None
+    digest = wordcloud_digest(place, frequencies)
+    png = read_cached_wordcloud(digest)
+    if png is None:
+        from matplotlib import pyplot as plt
+
+        fig = reviews_wordcloud(frequencies)
+        buffer = io.BytesIO()
+        # same resolution as st.pyplot
+        fig.savefig(buffer, format="png", dpi=200, bbox_inches="tight")
+        plt.close(fig)
+        png = buffer.getvalue()
+        write_cached_wordcloud(digest, place, png)
+    return png
+
+
 def average_rating_overtime(df):
     """
     Function to plot Bar Chart to visualize average rating
@@ -132,9 +235,7 @@ def rating_breakdown_pie(df: pd.DataFrame) -> go.Figure:
     """
     df = df.groupby("rating")["text"].count().reset_index()
     df["rating"] = df["rating"].astype(int)
-    df["Rating-Formatted"] = df["rating"].map({
-        5: "⭐ 5 😊", 4: "⭐ 4 🙂", 3: "⭐ 3 😕", 2: "⭐ 2 😒", 1: "⭐ 1 😑"
-    })
+    df["Rating-Formatted"] = df["rating"].map(RATING_LABELS)
     df.sort_values(by="rating", ascending=True, inplace=True)
     fig = go.Figure(
         go.Pie(
@@ -177,23 +278,33 @@ def sentiment_score_overtime(df):
     return fig
 
 
-def pharmacies_choropleth(df):
+def pharmacies_choropleth(df, zoom=7.4):
     """
     Function to plot map plot based on average rating w.r.t region
-    :param df: The input DataFrame containing review data.
+    :param df: The input DataFrame containing pharmacies data.
+    :param zoom: initial zoom of the map, also selects the detail of the cantons geometry.
     :return: A Plotly Figure showing rating density per region.
     """
-    # LOAD geojson FILE
-    with open("data/georef-switzerland-kanton.geojson") as response:
-        geo = json.load(response)
+    # cached, simplified cantons geometry
+    geo = cantons_geojson(detail_for_zoom(zoom))
+
+    # average rating per canton, weighted by the number of reviews of each pharmacy
+    df = df.assign(weightedRating=df["averageRating"] * df["totalReviews"])
+    cantons = df.groupby("canton", observed=True).agg(weightedRating=("weightedRating", "sum"),
+                                                      totalReviews=("totalReviews", "sum"),
+                                                      pharmacies=("name", "count"))
+    cantons = cantons[cantons["totalReviews"] > 0]
+    cantons["averageRating"] = cantons["weightedRating"] / cantons["totalReviews"]
 
     # Geographic Map
     fig = go.Figure(
         go.Choroplethmapbox(
             geojson=geo,
-            locations=df["city"],
+            locations=cantons.index,
             featureidkey="properties.kan_name",
-            z=df["averageRating"],
+            z=cantons["averageRating"],
+            text=cantons["pharmacies"].astype(str) + " pharmacies, " +
+                 cantons["totalReviews"].astype(str) + " reviews",
             colorscale="sunsetdark",
             marker_opacity=0.8,
             marker_line_width=1,
@@ -201,7 +312,7 @@ def pharmacies_choropleth(df):
     )
     fig.update_layout(
         mapbox_style="carto-positron",
-        mapbox_zoom=7.4,
+        mapbox_zoom=zoom,
         mapbox_center={"lat": 46.9, "lon": 7.44},
         height=600,
         margin={"r": 0, "t": 0, "l": 0, "b": 0},
@@ -9,5 +9,9 @@ source venv/bin/activate
 # Install dependencies
 pip install -r requirements.txt
 
+# Download the NLTK corpora into data/nltk_data, the app itself never downloads them
+python cli.py provision
+# Build the small card images into assets/thumbnails
+python cli.py assets
 
 echo "Setup completed. To run the Streamlit app, use 'streamlit run app.py' or refer to readme.md file."
@@ -1,3 +1,6 @@
+import json
+from html import escape
+
 # ----------------------- CUSTOMIZED HTML COMPONENTS ------------------------------
 
 POPUP = """
@@ -32,6 +35,37 @@ POPUP = """
 """
 
 
+# Javascript callback for folium's FastMarkerCluster, the popup is only rendered when a marker is opened.
+# row: [latitude, longitude, name, address, rating, reviews, contact, markerColor]
+MARKER_CALLBACK = """
+    function (row) {
+        var parts = %s;
+        var marker = L.marker(new L.LatLng(row[0], row[1]));
+        marker.setIcon(L.AwesomeMarkers.icon({icon: "medkit", prefix: "fa", markerColor: row[7]}));
+        marker.bindTooltip(row[2]);
+        marker.bindPopup(function () {
+            var html = parts[0];
+            for (var i = 1; i < parts.length; i++) {
+                html += row[i + 1] + parts[i];
+            }
+            return html;
+        }, {minWidth: 150, maxWidth: 300});
+        return marker;
+    }
+""" % json.dumps(POPUP.split("{}"))
+
+
+# style rule of one thumbnail, formatted with its name and base64 encoded WebP bytes
+THUMBNAIL_STYLE = """
+    .thumbnail-{0} {{
+        width: 100%; aspect-ratio: 1; border-radius: 50%;
+        background: url("data:image/webp;base64,{1}") center / contain no-repeat;
+    }}
+"""
+
+THUMBNAIL = """<div class="thumbnail-{}"></div>"""
+
+
 def card_view(name, address, rating, reviews, contact):
     return f"""
         <div>
@@ -84,3 +118,23 @@ def review_card(name, date, stars):
             </div>
         </div>
         """
+
+
+def review_row(name, date, stars, text):
+    # one review as laid out by the cards of a reviews page: reviewer image, review card, text and separator
+    text = "" if text == "nan" else escape(text).replace("\n", "<br>")
+    row = f"""
+        <div style="align-items:center;display: flex;gap: 1rem;">
+            <div style="flex: 1;">{THUMBNAIL.format("reviewer")}</div>
+            <div style="flex: 6;">{review_card(escape(name), date, stars)}</div>
+        </div>
+        <p>{text}</p>
+        <hr>
+        """
+    # on one line, blank or indented lines would end the HTML block in markdown
+    return " ".join(line.strip() for line in row.splitlines() if line.strip())
+
+
+def review_rows(rows):
+    # a whole page of reviews as a single HTML block, rows of (name, date, stars, text)
+    return f"<div>{''.join(review_row(*row) for row in rows)}</div>"
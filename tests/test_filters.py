@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from filters import FILTER_COLUMNS, filter_listings, index_listings, rank_listings
+from utils import pre_process_listings_data
+
+CITIES = [("Bahnhofstrasse 1, 8001 Zürich, Switzerland", 47.37, 8.54),
+          ("Marktgasse 5, 3011 Bern, Switzerland", 46.95, 7.45),
+          ("Rue du Rhône 10, 1204 Genève, Switzerland", 46.20, 6.15),
+          # neither the coordinates nor the city resolve to a canton
+          ("Nowhere 1, 9999 Atlantis, Switzerland", np.nan, np.nan)]
+
+
+@pytest.fixture
+def listings() -> pd.DataFrame:
+    rows = []
+    for k in range(40):
+        address, latitude, longitude = CITIES[k % len(CITIES)]
+        rows.append({"name": f"Pharmacy {k % 30}", "address": address, "averageRating": (k * 7 % 50) / 10,
+                     "latitude": latitude, "longitude": longitude, "totalReviews": k * 13 % 250, "id": str(k),
+                     "createdAt": "2023-01-01", "contact": "044 123 45 67"})
+    return pre_process_listings_data(pd.DataFrame(rows, dtype=object))
+
+
+def test_listings_without_canton_are_ranked(listings):
+    assert listings["canton"].isna().sum() == 10
+    order = rank_listings(listings)
+    assert sorted(order) == list(range(40))
+    ranked = listings.iloc[order]
+    assert (np.diff(ranked["totalReviews"]) <= 0).all()
+    assert len(filter_listings(index_listings(listings), {"city": []}, order=order)) == 40
+
+
+@pytest.fixture
+def columns() -> pd.DataFrame:
+    rng = np.random.default_rng(7)
+    values = {"adjustedRating": [0, 1, 2, 3, 4, 5], "adjustedReview": ["Up-to 50", "50 to 100", "100-200"],
+              "city": ["Zürich", "Bern", "Basel", None], "name": [f"Pharmacy {i}" for i in range(12)] + [None],
+              "address": [f"Street {i}" for i in range(20)]}
+    data = pd.DataFrame({column: rng.choice(np.array(values[column], dtype=object), 200) for column in FILTER_COLUMNS})
+    return data.astype({"adjustedRating": int})
+
+
+def isin_rows(data: pd.DataFrame, filters: dict) -> np.ndarray:
+    # the filters the Map and List View applied before the index, one isin per selected column
+    mask = np.ones(len(data), dtype=bool)
+    for column, selected in filters.items():
+        if selected:
+            mask &= data[column].isin(selected).to_numpy()
+    return np.flatnonzero(mask)
+
+
+def test_filters_match_isin(columns):
+    rng = np.random.default_rng(11)
+    listing_index = index_listings(columns)
+    order = rng.permutation(len(columns))
+    for _ in range(200):
+        filters = {}
+        for column in rng.choice(FILTER_COLUMNS, size=rng.integers(0, 4), replace=False):
+            present = columns[column].dropna().unique().tolist()
+            filters[column] = rng.choice(present + ["not listed"], size=rng.integers(0, 4)).tolist()
+        expected = isin_rows(columns, filters)
+        np.testing.assert_array_equal(filter_listings(listing_index, filters), expected)
+        np.testing.assert_array_equal(filter_listings(listing_index, filters, order=order),
+                                      order[np.isin(order, expected)])
+
+
+def test_missing_values_are_never_selected(columns):
+    codes, positions, bounds = index_listings(columns)["city"]
+    missing = np.flatnonzero(columns["city"].isna())
+    # the rows without a value form the block before that of the first value
+    np.testing.assert_array_equal(np.sort(positions[:bounds[0]]), missing)
+    rows = filter_listings(index_listings(columns), {"city": list(codes)})
+    np.testing.assert_array_equal(rows, np.flatnonzero(columns["city"].notna()))
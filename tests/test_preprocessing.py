@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import pre_process_listings_data
+
+# Bucket boundaries of markerColor (25, 50, 100) and adjustedReview (50, 100, 200).
+TOTAL_REVIEWS = [0, 24, 25, 49, 50, 51, 99, 100, 101, 199, 200, 201, np.nan, "42", "150", "not a number"]
+AVERAGE_RATINGS = [0.0, 0.99, 1.0, 2.5, 3.999, 4.0, 4.5, 5.0, np.nan, "4.2", "3", "n/a"]
+CONTACTS = ["+41 44 123 45 67", "044/123.45.67", 41441234567, np.nan, "", "Tel: 031 000 00 00"]
+ADDRESSES = ["Bahnhofstrasse 1, 8001 Zürich, Switzerland", "Marktgasse 5, 3011 Bern, Switzerland",
+             "Rue du Rhône 10, 1204 Genève, Switzerland", "Freie Strasse 2, 4001 Basel, Switzerland"]
+COORDINATES = [(47.37, 8.54), (46.95, 7.45), (46.20, 6.15), (np.nan, np.nan)]
+
+
+def apply_based_listings(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    pre_process_listings_data as it was before its derived columns were vectorized, without the later 'canton'.
+    """
+    data.reset_index(inplace=True)
+    numeric_cols = ['averageRating', 'latitude', 'longitude', 'totalReviews', 'id']
+    for column in numeric_cols:
+        data[column] = pd.to_numeric(data[column], errors='coerce', downcast='float')
+    data['createdAt'] = pd.to_datetime(data['createdAt'])
+    data["contact"] = data["contact"].apply(lambda x: ''.join(filter(str.isdigit, str(x))))
+    data.fillna(0, inplace=True)
+    data["markerColor"] = data["totalReviews"].apply(
+        lambda x: "green" if x >= 100 else ("orange" if x >= 50 else ("lightgray" if x >= 25 else "red")))
+    data["totalReviews"] = data["totalReviews"].astype(int)
+    data["city"] = data["address"].apply(lambda x: x.split(', ')[-2].split(' ')[-1])
+
+    def adjusted_reviews(review: int) -> str:
+        if review >= 200:
+            return "More than 200"
+        elif 100 < review <= 200:
+            return "100-200"
+        elif 50 < review <= 100:
+            return "50 to 100"
+        else:
+            return "Up-to 50"
+
+    data["adjustedReview"] = data["totalReviews"].apply(adjusted_reviews)
+    data["adjustedRating"] = data["averageRating"].apply(lambda x: int(x // 1))
+    data.sort_values(by='totalReviews', inplace=True)
+    data.reset_index(drop=True, inplace=True)
+    return data
+
+
+@pytest.fixture
+def listings() -> pd.DataFrame:
+    rows = []
+    for i, total_reviews in enumerate(TOTAL_REVIEWS):
+        for j, average_rating in enumerate(AVERAGE_RATINGS):
+            k = i * len(AVERAGE_RATINGS) + j
+            latitude, longitude = COORDINATES[k % len(COORDINATES)]
+            rows.append({"name": f"Pharmacy {k}", "address": ADDRESSES[k % len(ADDRESSES)],
+                         "averageRating": average_rating, "latitude": latitude, "longitude": longitude,
+                         "totalReviews": total_reviews, "id": str(k), "createdAt": f"2023-01-{1 + k % 28:02d}",
+                         "contact": CONTACTS[k % len(CONTACTS)]})
+    return pd.DataFrame(rows, dtype=object)
+
+
+def test_listings_match_apply_based_implementation(listings):
+    expected = apply_based_listings(listings.copy())
+    result = pre_process_listings_data(listings.copy())
+    pd.testing.assert_frame_equal(result.drop(columns="canton"), expected)
+
+
+def test_review_buckets_at_boundaries(listings):
+    result = pre_process_listings_data(listings.copy()).drop_duplicates("totalReviews").set_index("totalReviews")
+    assert result.loc[[24, 25, 49, 50, 99, 100], "markerColor"].tolist() == \
+        ["red", "lightgray", "lightgray", "orange", "orange", "green"]
+    assert result.loc[[50, 51, 100, 101, 199, 200, 201], "adjustedReview"].tolist() == \
+        ["Up-to 50", "50 to 100", "50 to 100", "100-200", "100-200", "More than 200", "More than 200"]
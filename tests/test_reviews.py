@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import RATING_LABELS, get_pharmacy_reviews, get_rating_rows, index_ratings, index_reviews
+
+PLACES = [f"Pharmacy {i}" for i in range(8)]
+
+
+@pytest.fixture
+def reviews() -> pd.DataFrame:
+    rng = np.random.default_rng(3)
+    size = 500
+    # missing ratings are stored as 0 by pre-processing, never selected
+    return pd.DataFrame({"place_Name": rng.choice(PLACES[:-1], size),
+                         "rating": rng.choice([0, 1, 2, 3, 4, 5], size).astype("int8"),
+                         "datetime": pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.permutation(size), unit="D")})
+
+
+def test_rating_rows_match_isin(reviews):
+    rng = np.random.default_rng(5)
+    reviews_data, review_index = index_reviews(reviews)
+    rating_index = index_ratings(reviews_data, review_index)
+    for place in PLACES:
+        pharmacy_reviews = get_pharmacy_reviews(reviews_data, review_index, place)
+        assert pharmacy_reviews["datetime"].is_monotonic_increasing
+        for size in range(len(RATING_LABELS) + 1):
+            ratings = rng.choice(list(RATING_LABELS), size=size, replace=False).tolist()
+            # the filter display_reviews applied before the index
+            expected = np.flatnonzero(pharmacy_reviews["rating"].isin(ratings))
+            np.testing.assert_array_equal(get_rating_rows(rating_index, place, ratings), expected)
+
+
+def test_unrated_reviews_are_never_selected(reviews):
+    reviews_data, review_index = index_reviews(reviews)
+    rating_index = index_ratings(reviews_data, review_index)
+    place = PLACES[0]
+    rows = get_rating_rows(rating_index, place, list(RATING_LABELS))
+    pharmacy_reviews = get_pharmacy_reviews(reviews_data, review_index, place)
+    assert (pharmacy_reviews["rating"] == 0).any()
+    np.testing.assert_array_equal(rows, np.flatnonzero(pharmacy_reviews["rating"] != 0))
+
+
+def test_reviews_without_place_are_in_no_block(reviews):
+    reviews["place_Name"] = reviews["place_Name"].astype(object)
+    reviews.loc[::10, "place_Name"] = np.nan
+    reviews_data, review_index = index_reviews(reviews)
+    for place, (start, stop) in review_index.items():
+        block = reviews_data.iloc[start:stop]
+        assert (block["place_Name"] == place).all()
+        assert len(block) == (reviews["place_Name"] == place).sum()
@@ -0,0 +1,50 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+import pytest
+
+import utils
+from utils import score_reviews, score_reviews_parallel, warm_sentiment_worker
+
+# English, French and fallback reviews: German ones need the provisioned NLTK corpora.
+TEXTS = ["Great friendly staff and quick service", "Terrible, rude and I waited an hour",
+         "Personnel très aimable, je recommande", "Accueil désagréable et long", "Servizio ottimo e veloce", ""]
+
+
+@pytest.fixture
+def reviews() -> pd.DataFrame:
+    texts = [text for _ in range(20) for text in TEXTS]
+    ratings = [float(1 + i % 5) for i in range(len(texts))]
+    return pd.DataFrame({"text": texts, "rating": ratings}, index=pd.RangeIndex(100, 100 + len(texts)))
+
+
+def test_parallel_scores_match_serial(reviews):
+    with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=warm_sentiment_worker) as executor:
+        parallel = score_reviews_parallel(reviews, executor=executor, chunk_size=7)
+    pd.testing.assert_frame_equal(parallel, score_reviews(reviews))
+
+
+class BrokenExecutor:
+    def map(self, *args, **kwargs):
+        raise BrokenProcessPool("a worker was terminated abruptly")
+
+    def shutdown(self, *args, **kwargs):
+        pass
+
+
+def test_broken_shared_pool_falls_back_to_serial(reviews, monkeypatch):
+    broken = BrokenExecutor()
+    monkeypatch.setattr(utils, "SENTIMENT_WORKERS", 2)
+    monkeypatch.setattr(utils, "_sentiment_executor", broken)
+    scores = score_reviews_parallel(reviews, chunk_size=7)
+    pd.testing.assert_frame_equal(scores, score_reviews(reviews))
+    # the next call starts a new pool instead of reusing the broken one
+    assert utils._sentiment_executor is None
+
+
+def test_broken_given_pool_raises(reviews):
+    with pytest.raises(BrokenProcessPool):
+        score_reviews_parallel(reviews, executor=BrokenExecutor(), chunk_size=7)
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_loader import write_snapshot, write_snapshot_chunks, append_snapshot, read_snapshot, read_review_chunks, \
+    read_review_stats, read_token_counts, read_watermark, select_new_reviews, pre_process_review_chunks
+from utils import pre_process_listings_data, pre_process_reviews, pharmacy_kpis
+
+PLACES = ["Pharmacy A", "Pharmacy B", "Pharmacy C"]
+
+
+@pytest.fixture
+def listings() -> pd.DataFrame:
+    return pre_process_listings_data(pd.DataFrame({
+        "name": PLACES,
+        "address": ["Bahnhofstrasse 1, 8001 Zürich, Switzerland", "Marktgasse 5, 3011 Bern, Switzerland",
+                    "Nowhere 1, 9999 Atlantis, Switzerland"],
+        "averageRating": [4.5, 3.0, 2.0], "latitude": [47.37, 46.95, np.nan], "longitude": [8.54, 7.45, np.nan],
+        "totalReviews": [120, 60, 10], "id": ["1", "2", "3"], "createdAt": ["2023-01-01"] * 3,
+        "contact": ["044 123 45 67", "031 000 00 00", ""]}, dtype=object))
+
+
+def raw_reviews(size: int, start: str = "2022-01-01") -> pd.DataFrame:
+    return pd.DataFrame({"place_Name": [PLACES[i % len(PLACES)] for i in range(size)],
+                         "reviewer": [f"r{i}" for i in range(size)],
+                         "rating": [1 + i % 5 for i in range(size)],
+                         "text": [f"Friendly staff number {i}" for i in range(size)],
+                         "datetime": pd.date_range(start, periods=size, freq="D").astype(str)})
+
+
+def test_roundtrip_keeps_missing_canton(listings, tmp_path):
+    write_snapshot(listings, pre_process_reviews(raw_reviews(10)), str(tmp_path))
+    data, _ = read_snapshot(str(tmp_path))
+    assert data.set_index("name")["canton"].isna().to_dict() == \
+        {"Pharmacy A": False, "Pharmacy B": False, "Pharmacy C": True}
+    assert "None" not in data["canton"].cat.categories
+    pd.testing.assert_series_equal(data["name"].astype(object), listings["name"])
+
+
+def test_roundtrip_with_blank_place(listings, tmp_path):
+    reviews = raw_reviews(10)
+    reviews.loc[3, "place_Name"] = np.nan
+    write_snapshot(listings, pre_process_reviews(reviews), str(tmp_path))
+    _, reviews_data = read_snapshot(str(tmp_path))
+    # filled with 0 by pre-processing, stored as the string like any other name
+    assert sorted(reviews_data["place_Name"].value_counts().items()) == \
+        [("0", 1), ("Pharmacy A", 3), ("Pharmacy B", 3), ("Pharmacy C", 3)]
+
+
+@pytest.mark.parametrize("extension", [".csv", ".jsonl"])
+def test_multi_chunk_export_with_changing_column_types(listings, tmp_path, extension):
+    reviews = raw_reviews(400)
+    # digits only in the first chunks, text afterwards
+    reviews["reviewer"] = [i if i < 250 else f"r{i}" for i in range(len(reviews))]
+    file = str(tmp_path / f"AllReviews{extension}")
+    if extension == ".csv":
+        reviews.to_csv(file, index=False)
+    else:
+        reviews.to_json(file, orient="records", lines=True)
+    write_snapshot_chunks(listings, pre_process_review_chunks(read_review_chunks(file, chunk_size=100)),
+                          str(tmp_path / "snapshot"))
+    _, reviews_data = read_snapshot(str(tmp_path / "snapshot"))
+    assert len(reviews_data) == 400
+    assert sorted(reviews_data["reviewer"]) == sorted(str(reviewer) for reviewer in reviews["reviewer"])
+
+
+@pytest.fixture
+def reviews_at_same_time() -> pd.DataFrame:
+    reviews = raw_reviews(30)
+    # the first snapshot ends at row 14, row 15 was posted at the same time
+    reviews.loc[15, "datetime"] = reviews.loc[14, "datetime"]
+    return reviews
+
+
+def test_select_new_reviews_after_watermark(listings, reviews_at_same_time, tmp_path):
+    write_snapshot(listings, pre_process_reviews(reviews_at_same_time.iloc[:15].copy()), str(tmp_path))
+    watermark = read_watermark(str(tmp_path))
+    assert watermark["datetime"] == pd.Timestamp(reviews_at_same_time.loc[14, "datetime"]).isoformat()
+    new_reviews = select_new_reviews(reviews_at_same_time.copy(), watermark)
+    assert sorted(new_reviews["reviewer"]) == sorted(f"r{i}" for i in range(15, 30))
+
+
+def test_append_matches_full_load(listings, reviews_at_same_time, tmp_path):
+    full, appended = str(tmp_path / "full"), str(tmp_path / "appended")
+    write_snapshot(listings, pre_process_reviews(reviews_at_same_time.copy()), full)
+    write_snapshot(listings, pre_process_reviews(reviews_at_same_time.iloc[:15].copy()), appended)
+    for _ in range(2):  # appending again finds nothing new
+        append_snapshot(listings, select_new_reviews(reviews_at_same_time.copy(), read_watermark(appended)), appended)
+
+    assert read_watermark(appended) == read_watermark(full)
+    pd.testing.assert_frame_equal(pharmacy_kpis(read_review_stats(appended)).sort_index(),
+                                  pharmacy_kpis(read_review_stats(full)).sort_index())
+
+    def token_totals(path: str) -> pd.Series:
+        counts = read_token_counts(path)
+        return counts.astype({"place_Name": str, "token": str}).groupby(["place_Name", "token"])["count"].sum()
+
+    pd.testing.assert_series_equal(token_totals(appended), token_totals(full))
+    assert len(read_snapshot(appended)[1]) == len(reviews_at_same_time)
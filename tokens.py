@@ -0,0 +1,115 @@
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+# Languages whose stopwords are removed from the review tokens, other reviews are counted as the closest one.
+TOKEN_LANGUAGES = ["en", "de", "fr"]
+# Same word pattern as WordCloud.generate.
+TOKEN_PATTERN = re.compile(r"\w[\w']*")
+# German and French stopwords, the English ones are those of WordCloud, see _stopwords.
+STOPWORDS = {
+    "de": set("""
+        aber alle allem allen aller alles als also am an ander andere anderem anderen anderer anderes anderm andern
+        anders auch auf aus bei bin bis bist da damit dann das dass dasselbe dazu daß dein deine deinem deinen deiner
+        dem demselben den denn denselben der derer derselbe derselben des desselben dessen dich die dies diese
+        dieselbe dieselben diesem diesen dieser dieses dir doch dort du durch ein eine einem einen einer eines einig
+        einige einigem einigen einiger einiges einmal er es etwas euch euer eure eurem euren eurer hab habe haben hat
+        hatte hatten hier hin hinter ich ihm ihn ihnen ihr ihre ihrem ihren ihrer im in indem ins ist jede jedem jeden
+        jeder jedes jene jenem jenen jener jenes jetzt kann kein keine keinem keinen keiner keines können könnte
+        machen man manche manchem manchen mancher manches mein meine meinem meinen meiner mich mir mit muss musste
+        nach nicht nichts noch nun nur ob oder ohne sehr sein seine seinem seinen seiner selbst sich sie sind so
+        solche solchem solchen solcher sollte sondern sonst um und uns unser unsere unter viel vom von vor war waren
+        warst was weg weil weiter welche welchem welchen welcher welches wenn werde werden wie wieder will wir wird
+        wirst wo wollen wollte während würde würden zu zum zur zwar zwischen
+        """.split()),
+    "fr": set("""
+        a ai aie aient ais ait alors as au aucun aussi autre aux avais avait avant avec avez avoir avons bon c ca ce
+        ceci cela celle celui ces cet cette ceux chaque ci comme comment d dans de des deux donc dont du elle elles
+        en encore es est et étaient était étant été être eu eux fait faire fois font hors ici il ils j je juste l la
+        là le les leur leurs lui m ma mais me même mes moi mon n ne ni nos notre nous on ont ou où par parce pas
+        peu peut plus pour pourquoi qu quand que quel quelle quelles quels qui s sa sans se sera ses seulement si
+        sien son sont sous soyez suis sur t ta te tes toi ton tous tout toute toutes très tu un une vos votre vous
+        vu y ça
+        """.split()),
+}
+
+
+@lru_cache(maxsize=None)
+def _stopwords(language: str) -> frozenset:
+    """
+    :param language: one of TOKEN_LANGUAGES
+    :return: lower-cased stopwords of the language
+    """
+    if language == "en":
+        # imported on first use like langid, wordcloud loads matplotlib
+        from wordcloud import STOPWORDS as ENGLISH_STOPWORDS
+        return frozenset(word.lower() for word in ENGLISH_STOPWORDS)
+    return frozenset(STOPWORDS[language])
+
+
+@lru_cache(maxsize=None)
+def _language_identifier():
+    """
+    Loads a language identifier restricted to TOKEN_LANGUAGES, separate from the
+    global one used for sentiment scores.
+    :return: langid LanguageIdentifier
+    """
+    from langid.langid import LanguageIdentifier, model
+
+    identifier = LanguageIdentifier.from_modelstring(model)
+    identifier.set_languages(TOKEN_LANGUAGES)
+    return identifier
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits a review text into lower-cased words the way WordCloud.generate does,
+    without the stopwords of the review's language.
+    :param text: review text
+    :return: list of tokens
+    """
+    language = _language_identifier().classify(text)[0]
+    stopwords = _stopwords(language)
+    words = (word[:-2] if word.endswith("'s") else word for word in TOKEN_PATTERN.findall(text.lower()))
+    return [word for word in words if not word.isdigit() and word not in stopwords]
+
+
+def token_counts(reviews: pd.DataFrame) -> pd.DataFrame:
+    """
+    Tokenizes every review once and counts the tokens per pharmacy and month.
+    Counts of different sets of reviews can simply be concatenated, token_frequencies adds them up.
+
+    :param reviews: The pre-processed reviews DataFrame.
+    :return: DataFrame with 'place_Name', 'month' (first day of the month), 'token' and 'count' columns.
+    """
+    tokens = pd.DataFrame({"place_Name": reviews["place_Name"].astype(str).to_numpy(),
+                           "month": reviews["datetime"].dt.to_period("M").dt.to_timestamp().to_numpy(),
+                           # reviews without text were stored as 'nan' by pre-processing
+                           "token": [[] if text == "nan" else tokenize(text) for text in reviews["text"]]})
+    tokens = tokens.explode("token").dropna(subset=["token"])
+    counts = tokens.groupby(["place_Name", "month", "token"], sort=False).size().rename("count").reset_index()
+    counts["count"] = counts["count"].astype("int32")
+    return counts
+
+
+def token_frequencies(counts: pd.DataFrame, token_index: Dict[str, Tuple[int, int]], place: str,
+                      start: Optional[pd.Timestamp] = None, end: Optional[pd.Timestamp] = None) -> Dict[str, int]:
+    """
+    Merges the token counts of a pharmacy over a range of months, ready for WordCloud.generate_from_frequencies.
+
+    :param counts: token counts grouped per pharmacy by utils.index_rows.
+    :param token_index: dict mapping 'place_Name' to (start, stop) row positions.
+    :param place: name of the pharmacy.
+    :param start: first day of the range, None for no lower bound. Months are counted whole.
+    :param end: last day of the range, None for no upper bound.
+    :return: dict mapping each token to its number of occurrences.
+    """
+    first, stop = token_index.get(place, (0, 0))
+    counts = counts.iloc[first:stop]
+    if start is not None:
+        counts = counts[counts["month"] >= pd.Timestamp(start).to_period("M").to_timestamp()]
+    if end is not None:
+        counts = counts[counts["month"] <= pd.Timestamp(end)]
+    return counts.groupby("token", observed=True, sort=False)["count"].sum().to_dict()
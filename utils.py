@@ -1,15 +1,45 @@
-from typing import Tuple
-
+import hashlib
+import multiprocessing
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing
+from functools import lru_cache
+from html import escape
+from typing import Tuple, Dict, Iterable, Optional, TYPE_CHECKING
+
+import numpy as np
 import pandas as pd
 import folium
-from template.html import POPUP
-from textblob_de import TextBlobDE
-from textblob_fr import PatternAnalyzer
-from textblob import TextBlob
-import langid
-import nltk
-
-nltk.download('punkt')
+from folium.plugins import FastMarkerCluster
+from geo import locate_cantons, assign_cantons
+from template.html import POPUP, MARKER_CALLBACK
+
+# The NLP stack takes long to import and is only needed for sentiment scores,
+# its modules are imported by the functions using them.
+if TYPE_CHECKING:
+    from textblob import Blobber
+    from textblob_de import BlobberDE
+
+# On-disk cache of (language, sentiment score) per review, see insert_sentiment_scores.
+SENTIMENT_CACHE_PATH = os.environ.get("SENTIMENT_CACHE_PATH", "data/sentiment_cache.sqlite")
+# Language and sentiment score per review digest, precomputed offline by `python cli.py score`.
+SENTIMENT_SCORES_PATH = os.environ.get("SENTIMENT_SCORES_PATH", "data/sentiment_scores.parquet")
+# Bump whenever language detection or scoring logic changes to invalidate cached scores.
+SENTIMENT_ANALYZER_VERSION = "1"
+# Worker processes used to score reviews, 1 scores them in the calling process.
+SENTIMENT_WORKERS = int(os.environ.get("SENTIMENT_WORKERS", os.cpu_count() or 1))
+# Reviews sent to a worker per task, smaller batches are scored in the calling process.
+SENTIMENT_CHUNK_SIZE = 500
+# Label of each star rating, shared by the rating filters and charts in the order they offer the ratings.
+RATING_LABELS = {5: "⭐ 5 😊", 4: "⭐ 4 🙂", 3: "⭐ 3 😕", 2: "⭐ 2 😒", 1: "⭐ 1 😑"}
+# Above this many pharmacies, create_map renders markers through a single client-side cluster layer.
+MAP_CLUSTER_THRESHOLD = 1000
+
+_sentiment_executor = None
+_sentiment_executor_lock = threading.Lock()
 
 
 def pre_process_data(data: pd.DataFrame, reviews: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
@@ -29,18 +59,21 @@ def pre_process_listings_data(data: pd.DataFrame) -> pd.DataFrame:
     Pre-processes pharmacy listings data.
     :param data: The input DataFrame containing pharmacy listings data.
     :return: Processed DataFrame with adjusted column datatypes, filled NaN values,
-    added markerColor based on totalReviews, adjustedReview, and adjustedRating columns.
+    added markerColor based on totalReviews, city, canton, adjustedReview, and adjustedRating columns.
     """
     # data = data.transpose()
     data.reset_index(inplace=True)
     data = adjust_column_datatypes(data)
     data.fillna(0, inplace=True)
-    data["markerColor"] = data["totalReviews"].apply(
-        lambda x: "green" if x >= 100 else ("orange" if x >= 50 else ("lightgray" if x >= 25 else "red")))
+    total_reviews = data["totalReviews"]
+    data["markerColor"] = np.select([total_reviews >= 100, total_reviews >= 50, total_reviews >= 25],
+                                    ["green", "orange", "lightgray"], default="red")
     data["totalReviews"] = data["totalReviews"].astype(int)
-    data["city"] = data["address"].apply(lambda x: x.split(', ')[-2].split(' ')[-1])
-    data["adjustedReview"] = data["totalReviews"].apply(adjusted_reviews)
-    data["adjustedRating"] = data["averageRating"].apply(lambda x: int(x // 1))
+    data["city"] = [address.split(', ')[-2].split(' ')[-1] for address in data["address"]]
+    # canton from coordinates, from the city name for pharmacies without usable coordinates
+    data["canton"] = locate_cantons(data["latitude"], data["longitude"]).fillna(assign_cantons(data["city"]))
+    data["adjustedReview"] = adjusted_reviews(data["totalReviews"])
+    data["adjustedRating"] = (data["averageRating"] // 1).astype(int)
     # Sort the DataFrame based on 'ranking'
     data.sort_values(by='totalReviews', inplace=True)
     data.reset_index(drop=True, inplace=True)
@@ -48,21 +81,15 @@ def pre_process_listings_data(data: pd.DataFrame) -> pd.DataFrame:
     return data
 
 
-def adjusted_reviews(review: int) -> str:
+def adjusted_reviews(reviews: pd.Series) -> np.ndarray:
     """
     Categorizes the number of reviews into different groups based on provided values.
 
-    :param review: The total number of reviews.
-    :return: A string indicating the category of the number of reviews.
+    :param reviews: Series with the total number of reviews per pharmacy.
+    :return: An array of strings indicating the category of the number of reviews.
     """
-    if review >= 200:
-        return "More than 200"
-    elif 100 < review <= 200:
-        return "100-200"
-    elif 50 < review <= 100:
-        return "50 to 100"
-    else:
-        return "Up-to 50"
+    return np.select([reviews >= 200, reviews > 100, reviews > 50],
+                     ["More than 200", "100-200", "50 to 100"], default="Up-to 50")
 
 
 def adjust_column_datatypes(df: pd.DataFrame) -> pd.DataFrame:
@@ -81,7 +108,7 @@ def adjust_column_datatypes(df: pd.DataFrame) -> pd.DataFrame:
     for column in numeric_cols:
         df[column] = pd.to_numeric(df[column], errors='coerce', downcast='float')
     df['createdAt'] = pd.to_datetime(df['createdAt'])
-    df["contact"] = df["contact"].apply(lambda x: ''.join(filter(str.isdigit, str(x))))
+    df["contact"] = [''.join(filter(str.isdigit, str(contact))) for contact in df["contact"]]
     return df
 
 
@@ -93,7 +120,6 @@ def pre_process_reviews(data: pd.DataFrame) -> pd.DataFrame:
         - Resets the index for consistency.
         - Adjusts column datatypes.
         - Fills missing values with 0.
-        - Converts the 'datetime' column to a formatted 'date' column.
         - Sorts the DataFrame by the 'datetime' column in ascending order.
 
     :param data: The input DataFrame containing reviews data.
@@ -103,11 +129,149 @@ def pre_process_reviews(data: pd.DataFrame) -> pd.DataFrame:
     data.reset_index(inplace=True)
     data = adjust_column_datatypes_of_reviews(data)
     data.fillna(0, inplace=True)
-    data["date"] = data["datetime"].dt.strftime("%d-%m-%Y")
     data.sort_values(by="datetime", ascending=True, inplace=True)
     return data
 
 
+def index_reviews(reviews: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, Tuple[int, int]]]:
+    """
+    Groups the reviews of each pharmacy into one contiguous block of rows.
+    Rows keep their 'datetime' order within a pharmacy.
+
+    :param reviews: The pre-processed reviews DataFrame.
+    :return: A tuple containing the reordered reviews DataFrame and a dict mapping
+    each 'place_Name' to the (start, stop) positions of its rows.
+    """
+    # the snapshot may hold several parts, each sorted on its own
+    return index_rows(reviews, order_by="datetime")
+
+
+def index_rows(df: pd.DataFrame, order_by: Optional[str] = None) -> Tuple[pd.DataFrame, Dict[str, Tuple[int, int]]]:
+    """
+    Groups the rows of each 'place_Name' of a DataFrame into one contiguous block.
+
+    :param df: DataFrame with a 'place_Name' column, e.g. reviews or token counts.
+    :param order_by: column to order the rows of each block by, None keeps their current order.
+    :return: A tuple containing the reordered DataFrame and a dict mapping
+    each 'place_Name' to the (start, stop) positions of its rows.
+    """
+    codes, places = pd.factorize(df["place_Name"])
+    order = np.argsort(codes, kind="stable") if order_by is None else np.lexsort((df[order_by].to_numpy(), codes))
+    df = df.iloc[order].reset_index(drop=True)
+    # rows without a 'place_Name' have the code -1 and are sorted first, in no pharmacy's block
+    bounds = np.bincount(codes + 1, minlength=len(places) + 1).cumsum()
+    index = {place: (int(start), int(stop)) for place, start, stop in zip(places, bounds[:-1], bounds[1:])}
+    return df, index
+
+
+def index_ratings(reviews: pd.DataFrame,
+                  review_index: Dict[str, Tuple[int, int]]) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Indexes the reviews of each pharmacy per rating, so that filtering them by rating takes a slice.
+
+    :param reviews: The reviews DataFrame returned by index_reviews.
+    :param review_index: dict mapping 'place_Name' to (start, stop) row positions.
+    :return: dict mapping each 'place_Name' to a tuple of the positions of its reviews within its block,
+    ordered by rating and then 'datetime', and the bounds of each rating in them: the reviews rated r
+    are at positions[bounds[r]:bounds[r + 1]].
+    """
+    slots = max(RATING_LABELS) + 1
+    ratings = np.nan_to_num(reviews["rating"].to_numpy(dtype=float)).astype(int)
+    # ratings outside RATING_LABELS, e.g. missing ones stored as 0, are never selected
+    ratings[(ratings < 0) | (ratings >= slots)] = 0
+    starts = np.array([start for start, _ in review_index.values()], dtype=int)
+    stops = np.array([stop for _, stop in review_index.values()], dtype=int)
+    blocks = np.repeat(np.arange(len(review_index)), stops - starts)
+    # lexsort is stable, rows of the same rating keep their 'datetime' order
+    order = np.lexsort((ratings, blocks))
+    positions = (order - starts[blocks]).astype(np.int32)
+    counts = np.bincount(blocks * slots + ratings, minlength=len(review_index) * slots).reshape(-1, slots)
+    bounds = np.hstack([np.zeros((len(review_index), 1), dtype=int), counts.cumsum(axis=1)])
+    return {place: (positions[start:stop], bounds[i])
+            for i, (place, (start, stop)) in enumerate(review_index.items())}
+
+
+def review_stats(reviews: pd.DataFrame) -> pd.DataFrame:
+    """
+    Aggregates the reviews of each pharmacy and year into additive totals,
+    so that the totals of newly ingested reviews can be merged with merge_review_stats.
+
+    :param reviews: The pre-processed reviews DataFrame.
+    :return: DataFrame indexed by 'place_Name' and 'year' with the 'reviews' count and the 'ratingSum'.
+    """
+    keys = [reviews["place_Name"].astype(str), reviews["datetime"].dt.year.rename("year")]
+    stats = reviews.groupby(keys).agg(reviews=("rating", "size"), ratingSum=("rating", "sum"))
+    stats["ratingSum"] = stats["ratingSum"].astype(float)
+    return stats
+
+
+def merge_review_stats(stats: pd.DataFrame, new_stats: pd.DataFrame) -> pd.DataFrame:
+    """
+    Merges the totals of two review_stats tables, e.g. the stored totals and those of newly ingested reviews.
+
+    :param stats: review_stats of the reviews already ingested.
+    :param new_stats: review_stats of the new reviews.
+    :return: review_stats of both sets of reviews.
+    """
+    merged = stats.add(new_stats, fill_value=0)
+    merged["reviews"] = merged["reviews"].astype(int)
+    return merged
+
+
+def pharmacy_kpis(stats: pd.DataFrame) -> pd.DataFrame:
+    """
+    Materializes the KPIs of the Reviews Analytics tab for all pharmacies at once.
+
+    :param stats: review_stats of all reviews.
+    :return: DataFrame indexed by 'place_Name' with 'totalReviews', 'averageRating',
+    'yearlyReviewsRate' (reviews per year with reviews) and 'ratingRatio' (rating weighted
+    share of all reviews, in percent).
+    """
+    grouped = stats.groupby(level="place_Name")
+    kpis = pd.DataFrame({"totalReviews": grouped["reviews"].sum(), "ratingSum": grouped["ratingSum"].sum(),
+                         "years": grouped.size()})
+    kpis["averageRating"] = kpis["ratingSum"] / kpis["totalReviews"]
+    kpis["yearlyReviewsRate"] = kpis["totalReviews"] / kpis["years"]
+    kpis["ratingRatio"] = kpis["ratingSum"] / kpis["totalReviews"].sum() * 100
+    return kpis[["totalReviews", "averageRating", "yearlyReviewsRate", "ratingRatio"]]
+
+
+def get_rating_rows(rating_index: Dict[str, Tuple[np.ndarray, np.ndarray]], place: str,
+                    ratings: Iterable[int]) -> np.ndarray:
+    """
+    Looks up which reviews of a pharmacy have the given ratings, using the index built by index_ratings.
+
+    :param rating_index: dict mapping 'place_Name' to its rating positions and bounds.
+    :param place: name of the pharmacy.
+    :param ratings: ratings to keep, keys of RATING_LABELS.
+    :return: positions within the reviews returned by get_pharmacy_reviews, in 'datetime' order.
+    """
+    if place not in rating_index:
+        return np.empty(0, dtype=np.int32)
+    positions, bounds = rating_index[place]
+    selected = [positions[bounds[rating]:bounds[rating + 1]] for rating in ratings]
+    if len(selected) == 0:
+        return np.empty(0, dtype=np.int32)
+    if len(selected) == 1:
+        return selected[0]
+    # positions grow with 'datetime' within a block
+    return np.sort(np.concatenate(selected))
+
+
+def get_pharmacy_reviews(reviews: pd.DataFrame, review_index: Dict[str, Tuple[int, int]],
+                         place: str) -> pd.DataFrame:
+    """
+    Returns the reviews of a pharmacy using the index built by index_reviews.
+
+    :param reviews: The reviews DataFrame returned by index_reviews.
+    :param review_index: dict mapping 'place_Name' to (start, stop) row positions.
+    :param place: name of the pharmacy.
+    :return: DataFrame with the reviews of the pharmacy, empty if it has none.
+    """
+    start, stop = review_index.get(place, (0, 0))
+    return reviews.iloc[start:stop]
+
+
 def adjust_column_datatypes_of_reviews(df: pd.DataFrame) -> pd.DataFrame:
     """
     Adjusts the data types of columns in a DataFrame related to reviews.
@@ -125,11 +289,12 @@ def adjust_column_datatypes_of_reviews(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def create_map(data: pd.DataFrame) -> folium.Map:
+def create_map(data: pd.DataFrame, cluster_threshold: int = MAP_CLUSTER_THRESHOLD) -> folium.Map:
     """
     Creates a Folium map with markers for pharmacies based on the provided DataFrame.
 
     :param data: The DataFrame containing pharmacy data.
+    :param cluster_threshold: number of pharmacies above which markers are clustered, see add_marker_cluster.
     :return: The Folium map with pharmacy markers.
     """
     if len(data) == 0:
@@ -139,6 +304,10 @@ def create_map(data: pd.DataFrame) -> folium.Map:
     # map_center = [46.9480, 7.4474]
     my_map = folium.Map(location=map_center, zoom_start=10, control_scale=True, prefer_canvas=True, )
 
+    if len(data) > cluster_threshold:
+        add_marker_cluster(my_map, data)
+        return my_map
+
     for i, row in data.iterrows():
         iframe = folium.IFrame(POPUP.format(
             str(row["name"]),
@@ -151,7 +320,7 @@ def create_map(data: pd.DataFrame) -> folium.Map:
         popup = folium.Popup(iframe, min_width=150, max_width=300)
         # Add each row to the map
         folium.Marker(location=[row['latitude'], row['longitude']],
-                      tooltip=row["name"],
+                      tooltip=escape(str(row["name"])),
                       # icon=folium.features.CustomIcon(icon_image=r"img0.png", icon_size=(70, 70)),
                       icon=folium.Icon(color=row['markerColor'],
                                        icon="medkit",
@@ -162,26 +331,23 @@ def create_map(data: pd.DataFrame) -> folium.Map:
     return my_map
 
 
-def get_star_ratings(rating_list: list) -> list:
+def add_marker_cluster(my_map: folium.Map, data: pd.DataFrame) -> None:
     """
-    Function to map customized string representation
-    of ratings to corresponding integer representation
-    :param rating_list: list of customized rating description
-    :return: list of equivalent integer description of star ratings
-    """
-    int_rating_list = []
-    for star in rating_list:
-        if star == "⭐ 5 😊":
-            int_rating_list.append(5)
-        elif star == "⭐ 4 🙂":
-            int_rating_list.append(4)
-        elif star == "⭐ 3 😕":
-            int_rating_list.append(3)
-        elif star == "⭐ 1 😑":
-            int_rating_list.append(2)
-        else:
-            int_rating_list.append(1)
-    return int_rating_list
+    Adds all pharmacies to the map as one FastMarkerCluster layer.
+    Only the popup fields are embedded per pharmacy, markers and popups
+    are built in the browser by template.html.MARKER_CALLBACK. The text fields are escaped,
+    the callback pastes them into the popup and tooltip HTML.
+
+    :param my_map: The Folium map to add the markers to.
+    :param data: The DataFrame containing pharmacy data.
+    :return: None
+    """
+    name, address, contact = ([escape(value) for value in data[column].astype(str)]
+                              for column in ("name", "address", "contact"))
+    rows = zip(data["latitude"].astype(float), data["longitude"].astype(float), name, address,
+               data["averageRating"].astype(float).round(1).astype(str), data["totalReviews"].astype(str),
+               contact, data["markerColor"].astype(str))
+    FastMarkerCluster([list(row) for row in rows], callback=MARKER_CALLBACK).add_to(my_map)
 
 
 def calculate_sentiment_score(row: pd.Series):
@@ -197,11 +363,12 @@ def calculate_sentiment_score(row: pd.Series):
     # calculating sentiment score based on language
     if lang in ['en', 'de', 'fr']:
         if lang == 'en':
+            from textblob import TextBlob
             return TextBlob(text).sentiment.polarity
         elif lang == 'de':
-            return TextBlobDE(text).sentiment.polarity
+            return _german_blobber()(text).sentiment.polarity
         elif lang == 'fr':
-            return TextBlob(text, analyzer=PatternAnalyzer()).sentiment[0]
+            return _french_blobber()(text).sentiment[0]
     # worst-case: text has no words or language other than English, German and French.
     if len(text) == 0 or lang not in ['en', 'de', 'fr']:
         rating = row['rating']
@@ -218,17 +385,219 @@ def calculate_sentiment_score(row: pd.Series):
     return None
 
 
+@lru_cache(maxsize=None)
+def _german_blobber() -> "BlobberDE":
+    """
+    Builds the German TextBlob factory once per process, so its punkt tokenizer is loaded only once.
+    :return: BlobberDE with default models
+    """
+    from nlp_resources import ensure_nltk_resources
+    from textblob_de import BlobberDE
+    # the German tokenizer is the only user of the NLTK corpora
+    ensure_nltk_resources()
+    return BlobberDE()
+
+
+@lru_cache(maxsize=None)
+def _french_blobber() -> "Blobber":
+    """
+    Builds the French TextBlob factory once per process, so its lexicon is loaded only once.
+    :return: Blobber using the textblob_fr PatternAnalyzer
+    """
+    from textblob import Blobber
+    from textblob_fr import PatternAnalyzer
+    return Blobber(analyzer=PatternAnalyzer())
+
+
+def warm_sentiment_worker() -> None:
+    """
+    Process pool initializer that loads the langid model and the analyzers before the first task.
+    :return: None
+    """
+    import langid
+    langid.classify("")
+    try:
+        _german_blobber()
+    except LookupError:
+        # corpora not provisioned, only German reviews need them and fail when they are scored
+        pass
+    _french_blobber()
+
+
+def _get_sentiment_executor() -> ProcessPoolExecutor:
+    """
+    Returns the process pool shared by all sessions, started on first use.
+    :return: ProcessPoolExecutor with SENTIMENT_WORKERS warm workers
+    """
+    global _sentiment_executor
+    with _sentiment_executor_lock:
+        if _sentiment_executor is None:
+            # workers are spawned, forking the multi-threaded server process could deadlock them
+            _sentiment_executor = ProcessPoolExecutor(max_workers=SENTIMENT_WORKERS,
+                                                      mp_context=multiprocessing.get_context("spawn"),
+                                                      initializer=warm_sentiment_worker)
+    return _sentiment_executor
+
+
+def _discard_sentiment_executor(executor: ProcessPoolExecutor) -> None:
+    """
+    Drops a broken shared process pool, so that the next call to _get_sentiment_executor starts a new one.
+    :param executor: the pool that broke
+    :return: None
+    """
+    global _sentiment_executor
+    with _sentiment_executor_lock:
+        if _sentiment_executor is executor:
+            _sentiment_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def review_digest(text: str, rating: float) -> str:
+    """
+    Function to compute the cache key of a review's sentiment score.
+    The rating is part of the key since it is the fallback score for unsupported languages.
+    :param text: review text
+    :param rating: star rating of the review
+    :return: hex digest of analyzer version, rating and text
+    """
+    # as float, so that the key does not depend on the dtype the ratings are stored in
+    payload = f"{SENTIMENT_ANALYZER_VERSION}\x1f{float(rating)}\x1f{text}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _connect_sentiment_cache() -> sqlite3.Connection:
+    """
+    Opens the sentiment cache database, creating its table on first use.
+    :return: sqlite3 connection to the cache file
+    """
+    conn = sqlite3.connect(SENTIMENT_CACHE_PATH, timeout=30)
+    conn.execute("CREATE TABLE IF NOT EXISTS sentiment "
+                 "(digest TEXT PRIMARY KEY, language TEXT, score REAL)")
+    return conn
+
+
+def read_cached_sentiment(digests: Iterable[str]) -> Dict[str, Tuple[str, float]]:
+    """
+    Function to look up cached sentiment results.
+    :param digests: review digests as returned by review_digest
+    :return: dict mapping each cached digest to its (language, score)
+    """
+    digests = list(set(digests))
+    cached = {}
+    with closing(_connect_sentiment_cache()) as conn:
+        # stay below SQLite's limit of host parameters per statement
+        for start in range(0, len(digests), 500):
+            chunk = digests[start:start + 500]
+            rows = conn.execute(f"SELECT digest, language, score FROM sentiment "
+                                f"WHERE digest IN ({','.join('?' * len(chunk))})", chunk)
+            cached.update({digest: (language, score) for digest, language, score in rows})
+    return cached
+
+
+def write_cached_sentiment(entries: Dict[str, Tuple[str, float]]) -> None:
+    """
+    Function to persist sentiment results.
+    :param entries: dict mapping review digests to (language, score)
+    :return: None
+    """
+    if not entries:
+        return
+    with closing(_connect_sentiment_cache()) as conn, conn:
+        conn.executemany("INSERT OR REPLACE INTO sentiment (digest, language, score) VALUES (?, ?, ?)",
+                         [(digest, language, None if pd.isna(score) else float(score))
+                          for digest, (language, score) in entries.items()])
+
+
+def score_reviews(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Function to detect the language and calculate the sentiment score of every review, without caching.
+    :param df: dataframe containing 'text' and 'rating' of reviews
+    :return: copy of the dataframe with added 'language' and 'sentiment_score' columns.
+    """
+    import langid
+    df = df.copy()
+    # Add a new column for language identification
+    df['language'] = df['text'].apply(lambda x: langid.classify(x)[0])
+    # Add a new column for sentiment scores using the calculate_sentiment_score function
+    df['sentiment_score'] = df.apply(calculate_sentiment_score, axis=1).astype(float)
+    return df
+
+
+def score_reviews_parallel(df: pd.DataFrame, executor: Optional[ProcessPoolExecutor] = None,
+                           chunk_size: int = SENTIMENT_CHUNK_SIZE) -> pd.DataFrame:
+    """
+    Function to score reviews like score_reviews, split into chunks across worker processes.
+    Results are identical to score_reviews, frames of at most one chunk are scored in the calling process.
+    :param df: dataframe containing 'text' and 'rating' of reviews
+    :param executor: process pool to use, defaults to a shared pool of SENTIMENT_WORKERS workers.
+    If the shared pool breaks, e.g. a worker was killed, the reviews are scored in the calling process
+    and the next call starts a new pool.
+    :param chunk_size: number of reviews per worker task
+    :return: copy of the dataframe with added 'language' and 'sentiment_score' columns.
+    """
+    if len(df) <= chunk_size or (executor is None and SENTIMENT_WORKERS <= 1):
+        return score_reviews(df)
+    shared = executor is None
+    if shared:
+        executor = _get_sentiment_executor()
+    chunks = [df.iloc[start:start + chunk_size] for start in range(0, len(df), chunk_size)]
+    try:
+        return pd.concat(executor.map(score_reviews, chunks))
+    except BrokenProcessPool:
+        if not shared:
+            raise
+        _discard_sentiment_executor(executor)
+        return score_reviews(df)
+
+
+def attach_sentiment_scores(reviews: pd.DataFrame, path: str = SENTIMENT_SCORES_PATH) -> pd.DataFrame:
+    """
+    Function to add the precomputed 'language' and 'sentiment_score' columns to the reviews.
+    Reviews missing from the scores file keep an empty language and are scored on demand
+    by insert_sentiment_scores.
+    :param reviews: dataframe containing pre-processed reviews data
+    :param path: parquet file written by `python cli.py score`
+    :return: dataframe with added columns, unchanged if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return reviews
+    scores = pd.read_parquet(path, columns=["digest", "language", "sentiment_score"]).set_index("digest")
+    digests = [review_digest(text, rating) for text, rating in zip(reviews['text'], reviews['rating'])]
+    reviews['language'] = scores['language'].reindex(digests).to_numpy()
+    reviews['sentiment_score'] = scores['sentiment_score'].reindex(digests).to_numpy()
+    return reviews
+
+
 def insert_sentiment_scores(df):
     """
     Function to insert sentiment score column
     to a dataframe containing review text.
+    Rows that already have a language (see attach_sentiment_scores) are kept as they are,
+    others are looked up in the on-disk cache and only unseen reviews are scored.
     :param df: dataframe containing reviews data
     :return: dataframe with added column representing sentiment scores.
     """
-    # Add a new column for language identification
-    df['language'] = df['text'].apply(lambda x: langid.classify(x)[0])
-
-    # Add a new column for sentiment scores using the calculate_sentiment_score function
-    df['sentiment_score'] = df.apply(calculate_sentiment_score, axis=1)
+    if 'language' not in df:
+        df['language'] = None
+        df['sentiment_score'] = np.nan
+    pending = df['language'].isna().to_numpy()
+    if not pending.any():
+        return df
+
+    pending_df = df[pending]
+    digests = pd.Series([review_digest(text, rating) for text, rating in zip(pending_df['text'], pending_df['rating'])],
+                        index=pending_df.index)
+    cached = read_cached_sentiment(digests)
+
+    missing = ~digests.isin(cached).to_numpy()
+    if missing.any():
+        scored_df = score_reviews_parallel(pending_df.loc[missing, ['text', 'rating']])
+        scored = dict(zip(digests[missing], zip(scored_df['language'], scored_df['sentiment_score'])))
+        write_cached_sentiment(scored)
+        cached.update(scored)
+
+    df.loc[pending, 'language'] = [cached[digest][0] for digest in digests]
+    df.loc[pending, 'sentiment_score'] = [cached[digest][1] for digest in digests]
+    df['sentiment_score'] = df['sentiment_score'].astype(float)
 
     return df